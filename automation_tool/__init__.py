@@ -1,13 +1,31 @@
-"""Automation tool package exports."""
-
-from .keystone import KeystoneSupplier
-from .cwr import CwrSupplier
-from .seawide import SeawideSupplier
-from .scheduler import RepeatedTimer
-
-__all__ = [
-    "KeystoneSupplier",
-    "CwrSupplier",
-    "SeawideSupplier",
-    "RepeatedTimer",
-]
+"""Automation tool package exports.
+
+Exports are imported on first access so importing the package, or running
+one supplier from cron, does not load every supplier and protocol module.
+"""
+
+import importlib
+
+# Exported name -> module defining it
+_EXPORTS = {
+    "KeystoneSupplier": ".keystone",
+    "CwrSupplier": ".cwr",
+    "SeawideSupplier": ".seawide",
+    "RepeatedTimer": ".scheduler",
+    "Scheduler": ".scheduler",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
@@ -1,15 +1,60 @@
 import json
 import os
 import logging
+import time
+from contextlib import contextmanager
 
+# Created by whichever module first writes below it, not on import.
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
-os.makedirs(DATA_DIR, exist_ok=True)
+ACCOUNTS_DIR = os.path.join(DATA_DIR, 'accounts')
+
+# Credentials naming output files; accounts get their own default file names.
+OUTPUT_CREDENTIALS = ('output', 'full_output', 'catalog_name')
+
+
+def file_stat(path):
+    """``[mtime, size]`` of ``path``, or ``None`` when unset or missing."""
+    if not path or not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_mtime, stat.st_size]
+
 
 class Supplier:
     """Generic supplier storing credentials and providing a fetch hook."""
-    def __init__(self, name: str, config_name: str):
-        self.name = name
-        self.config_path = os.path.join(DATA_DIR, config_name)
+    # Default column names used for delta tracking; override per supplier
+    # or through the ``sku_field``/``quantity_field``/``price_field`` credentials.
+    sku_field = 'SKU'
+    quantity_field = 'Quantity'
+    price_field = 'Price'
+    # Incremental pulls re-request this many seconds before the watermark
+    # (``watermark_overlap`` credential) and fall back to a full pull when the
+    # watermark is older than ``watermark_max_gap``.
+    watermark_overlap = 5 * 60
+    watermark_max_gap = 24 * 60 * 60
+    # Warehouse columns per region used by the ``aggregation`` credential
+    # when its rules name no regions; ``None`` treats the quantity as one region.
+    warehouse_regions = None
+    # Full inventory file written by ``fetch_inventory_full`` (``full_output``
+    # credential) and its delimiter, read by the unified merge.
+    full_output = None
+    output_delimiter = ','
+    # True when outputs are already keyed by the mapped (internal) SKU.
+    maps_output = False
+
+    def __init__(self, name: str, config_name: str, account: str = None):
+        stem = os.path.splitext(config_name)[0]
+        self.account = account
+        if account:
+            # Additional accounts live in data/accounts/<supplier>/<account>.json
+            # and keep their own catalog, snapshots and state.
+            self.name = f'{name}-{account}'
+            self.config_path = os.path.join(ACCOUNTS_DIR, stem, f'{account}.json')
+            self.state_name = f'{stem}-{account}'
+        else:
+            self.name = name
+            self.config_path = os.path.join(DATA_DIR, config_name)
+            self.state_name = stem
         self.credentials = {}
         self.load()
 
@@ -19,6 +64,7 @@ class Supplier:
                 self.credentials = json.load(f)
 
     def save(self) -> None:
+        os.makedirs(os.path.dirname(self.config_path), exist_ok=True)
         with open(self.config_path, 'w') as f:
             json.dump(self.credentials, f)
 
@@ -27,8 +73,143 @@ class Supplier:
         self.save()
 
     def get_credential(self, key: str, default=None):
+        if self.account and key in OUTPUT_CREDENTIALS and key not in self.credentials and default:
+            root, ext = os.path.splitext(default)
+            return f'{root}_{self.account}{ext}'
         return self.credentials.get(key, default)
 
+    @property
+    def state(self):
+        """Persistent run state such as download validators for this supplier."""
+        from .state import open_store
+        return open_store(self.state_name)
+
+    def get_watermark(self, job: str):
+        """UNIX time up to which ``job`` last pulled changes, or ``None``."""
+        return self.state.get(f'watermark:{job}')
+
+    def set_watermark(self, job: str, value: int) -> None:
+        self.state.set(f'watermark:{job}', int(value))
+
+    def incremental_since(self, job: str, now: float = None) -> int:
+        """Timestamp to request ``job`` changes from, or 0 for a full pull.
+
+        The stored watermark minus the overlap is used unless it is missing
+        or older than the maximum gap, in which case changes may have been
+        missed and everything is requested again.
+        """
+        mark = self.get_watermark(job)
+        now = time.time() if now is None else now
+        overlap = int(self.get_credential('watermark_overlap', self.watermark_overlap))
+        max_gap = int(self.get_credential('watermark_max_gap', self.watermark_max_gap))
+        if mark is None or now - mark > max_gap:
+            return 0
+        return max(mark - overlap, 0)
+
+    @contextmanager
+    def conditional_ftp(self, job: str, remote: str, output: str, credentials: dict,
+                        ticket=None, mapping_file: str = None, requires=()):
+        """Download ``remote`` for ``job`` unless it is unchanged.
+
+        Yields ``True`` when a new file was downloaded and ``False`` when the
+        remote ``MDTM``/``SIZE`` match the last successful run. They are only
+        recorded once the ``with`` block finishes without raising, so failed
+        processing is retried on the next run. The file is also processed
+        again when ``mapping_file`` has changed since or a path in
+        ``requires``, such as the catalog store, is missing. ``ticket`` is
+        passed to :meth:`.ftpsession.FtpPool.download`.
+        """
+        from .ftpsession import POOL
+        key = f'ftp:{job}:{remote}'
+        mapping = file_stat(mapping_file)
+        previous = self.state.get(key) or {}
+        if previous.get('mapping') != mapping or not all(os.path.exists(p) for p in requires):
+            previous = {}
+        previous = {k: v for k, v in previous.items() if k != 'mapping'}
+        stat = POOL.download(remote, output, previous=previous, ticket=ticket,
+                             **self.output_options(), **credentials)
+        yield stat is not None
+        if stat is not None:
+            self.state.set(key, dict(stat, mapping=mapping))
+
+    @contextmanager
+    def track_delta(self, rows, output, full: bool = True):
+        """Yield ``rows`` wrapped so the pull also writes a delta file next to ``output``.
+
+        Write ``output`` inside the ``with`` block: the delta and snapshot
+        are only committed once it has completed.
+        """
+        from . import delta, metrics
+        with delta.track(
+            self.name,
+            rows,
+            delta.delta_path(output),
+            sku_field=self.get_credential('sku_field', self.sku_field),
+            quantity_field=self.get_credential('quantity_field', self.quantity_field),
+            price_field=self.get_credential('price_field', self.price_field),
+            full=full,
+        ) as tracked:
+            yield metrics.stage('delta', tracked)
+
+    def aggregate(self, rows):
+        """Apply the ``aggregation`` credential rules to ``rows`` if set."""
+        rules = self.get_credential('aggregation')
+        if not rules:
+            return rows
+        from . import aggregation, metrics
+        aggregator = aggregation.Aggregator.from_config(
+            rules,
+            quantity_field=self.get_credential('quantity_field', self.quantity_field),
+            regions=self.warehouse_regions,
+        )
+        return metrics.stage('aggregate', aggregator(rows))
+
+    def parse_workers(self) -> int:
+        """Processes used to parse large downloaded files (``parse_workers``)."""
+        return max(int(self.get_credential('parse_workers', 1) or 1), 1)
+
+    def timeout(self) -> float:
+        """Seconds one network operation may block (``timeout`` credential)."""
+        from .resilience import DEFAULT_TIMEOUT
+        return float(self.get_credential('timeout', DEFAULT_TIMEOUT))
+
+    def call_endpoint(self, endpoint: str, function):
+        """Call ``function()`` with retries through the circuit of ``endpoint``.
+
+        Transient failures are retried up to the ``retries`` credential
+        times; see :mod:`.resilience`. Raises ``CircuitOpen`` without calling
+        ``function`` while the endpoint is known to be down.
+        """
+        from . import resilience
+        attempts = int(self.get_credential('retries', resilience.RETRIES))
+        return resilience.circuit(endpoint).call(resilience.retry, function, attempts)
+
+    def failover(self, primary, secondary) -> bool:
+        """Run ``primary(ticket)``, falling back to ``secondary(ticket)``.
+
+        Both return whether they delivered. With the ``hedge_after``
+        credential the secondary also starts once the primary has taken that
+        many seconds, and whichever finishes first wins.
+        """
+        budget = self.get_credential('hedge_after')
+        if budget:
+            from . import resilience
+            return resilience.hedge(primary, secondary, float(budget), name=f'{self.name}-hedge')
+        if primary(None):
+            return True
+        logging.info('Falling back to the secondary method for %s', self.name)
+        return bool(secondary(None))
+
+    def output_options(self) -> dict:
+        """Rotation and compression of written files for :mod:`.outputs`.
+
+        Set with the ``output_generations`` and ``output_compress`` credentials.
+        """
+        return {
+            'generations': int(self.get_credential('output_generations', 0) or 0),
+            'compress': self.get_credential('output_compress') or None,
+        }
+
     def fetch_inventory(self) -> None:
         logging.info("Fetching inventory for %s", self.name)
 
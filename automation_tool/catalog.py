@@ -1,62 +1,409 @@
 import csv
+import json
 import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from itertools import islice
 from .base import DATA_DIR
+from . import metrics, outputs
+from .rows import RowTable, record_type
 
 CATALOG_DIR = os.path.join(DATA_DIR, 'catalogs')
-os.makedirs(CATALOG_DIR, exist_ok=True)
+
+# Rows are inserted in batches of this size when a catalog is replaced.
+BATCH_SIZE = 10000
+# Columns indexed for lookups; the first one a catalog has is used.
+UPC_FIELDS = ('UPC', 'UPC/EAN', 'UPCCode', 'upc')
+MANUFACTURER_FIELDS = ('Manufacturer', 'Brand', 'VendorName', 'manufacturer', 'VendorCode')
+# How :func:`save_rows` treats rows repeating a SKU: store them all, or keep
+# only the first or last row of each SKU. Rows without a SKU are always kept.
+DUPLICATES = ('keep', 'first', 'last')
+
+_connections = {}
+_locks = {}
+_lock = threading.Lock()
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS rows (
+    id INTEGER PRIMARY KEY,
+    sku TEXT NOT NULL,
+    upc TEXT,
+    manufacturer TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+'''
+
+INDEXES = '''
+CREATE INDEX IF NOT EXISTS rows_sku ON rows (sku);
+CREATE INDEX IF NOT EXISTS rows_upc ON rows (upc);
+CREATE INDEX IF NOT EXISTS rows_manufacturer ON rows (manufacturer COLLATE NOCASE);
+'''
 
 
 def catalog_path(name: str) -> str:
+    """Path of the CSV export read by downstream consumers."""
     return os.path.join(CATALOG_DIR, f"{name}.csv")
 
 
-def apply_mapping(rows: list, mapping_file: str) -> list:
-    """Apply a SKU mapping file if provided."""
-    if not mapping_file or not os.path.exists(mapping_file):
-        return rows
-    with open(mapping_file, newline='') as f:
-        mapping = {r['sku']: r['modified_sku'] for r in csv.DictReader(f)}
-    new_rows = []
+def db_path(name: str) -> str:
+    """Path of the SQLite store indexed by SKU."""
+    return os.path.join(CATALOG_DIR, f"{name}.db")
+
+
+def _exists(name: str) -> bool:
+    return os.path.exists(db_path(name)) or os.path.exists(catalog_path(name))
+
+
+def _connect(name: str) -> sqlite3.Connection:
+    """Return the open store for ``name``, creating it on first use.
+
+    Connections stay open for the life of the process so single-row deletes
+    do not pay for a checkpoint each; use :func:`_store` to hold the
+    catalog's lock while working with one. A legacy CSV catalog is imported
+    the first time its store is created.
+    """
+    conn = _connections.get(name)
+    if conn is not None:
+        return conn
+    migrate = not os.path.exists(db_path(name)) and os.path.exists(catalog_path(name))
+    os.makedirs(CATALOG_DIR, exist_ok=True)
+    conn = sqlite3.connect(db_path(name), check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    conn.executescript(INDEXES)
+    if migrate:
+        with open(catalog_path(name), newline='') as f:
+            _replace(conn, csv.DictReader(f))
+    _connections[name] = conn
+    return conn
+
+
+@contextmanager
+def _store(name: str):
+    with _lock:
+        lock = _locks.setdefault(name, threading.RLock())
+    with lock:
+        yield _connect(name)
+
+
+def _get_meta(conn, key: str, default=None):
+    row = conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    return json.loads(row[0]) if row else default
+
+
+def _set_meta(conn, key: str, value) -> None:
+    conn.execute(
+        'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+        (key, json.dumps(value)),
+    )
+
+
+def _lookup_field(fields, candidates):
+    return next((f for f in candidates if f in fields), None)
+
+
+def _text(value):
+    return None if value is None or value == '' else str(value)
+
+
+def _batches(rows, fields: list, sku_field: str):
+    """Yield insert parameters for ``rows`` in batches.
+
+    .NET datasets omit null columns, so rows need not share their keys.
+    ``fields`` grows to the union of them in order of first appearance and
+    each row is stored as its values for the fields known so far.
+    """
+    known = set(fields)
+    upc_field = _lookup_field(fields, UPC_FIELDS)
+    manufacturer_field = _lookup_field(fields, MANUFACTURER_FIELDS)
+    last = None
+    batch = []
     for r in rows:
-        sku = r.get('SKU')
-        if sku in mapping:
-            r = r.copy()
-            r['SKU'] = mapping[sku]
-        new_rows.append(r)
-    return new_rows
-
-
-def save_rows(name: str, rows: list) -> None:
-    path = catalog_path(name)
-    if not rows:
-        open(path, 'w').close()
+        # Records of one schema share their fields tuple.
+        keys = getattr(r, 'fields', None)
+        if keys is None or keys is not last:
+            new = [k for k in r if k not in known]
+            if new:
+                fields.extend(new)
+                known.update(new)
+                upc_field = upc_field or _lookup_field(new, UPC_FIELDS)
+                manufacturer_field = manufacturer_field or _lookup_field(new, MANUFACTURER_FIELDS)
+            last = keys
+        data = json.dumps([r.get(k, '') for k in fields], default=str)
+        batch.append((
+            r.get(sku_field) or '',
+            _text(r.get(upc_field)) if upc_field else None,
+            _text(r.get(manufacturer_field)) if manufacturer_field else None,
+            data,
+        ))
+        if len(batch) >= BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _values(data: str, width: int) -> list:
+    """Stored values, padded with ``''`` for columns first seen in later rows."""
+    values = json.loads(data)
+    if len(values) < width:
+        values += [''] * (width - len(values))
+    return values
+
+
+def _replace(conn, rows, sku_field: str = 'SKU', duplicates: str = 'keep') -> int:
+    """Replace the catalog contents with ``rows`` inside one transaction."""
+    if duplicates not in DUPLICATES:
+        raise ValueError(f'Unknown duplicates policy: {duplicates}')
+    fields = []
+    with conn:
+        conn.execute('DELETE FROM rows')
+        # Building the lookup indexes once afterwards beats updating them per row.
+        conn.execute('DROP INDEX IF EXISTS rows_sku')
+        conn.execute('DROP INDEX IF EXISTS rows_upc')
+        conn.execute('DROP INDEX IF EXISTS rows_manufacturer')
+        for batch in _batches(rows, fields, sku_field):
+            conn.executemany(
+                'INSERT INTO rows (sku, upc, manufacturer, data) VALUES (?, ?, ?, ?)',
+                batch,
+            )
+        if duplicates != 'keep':
+            keep = 'MIN' if duplicates == 'first' else 'MAX'
+            conn.execute(
+                f"DELETE FROM rows WHERE sku != '' AND id NOT IN "
+                f"(SELECT {keep}(id) FROM rows WHERE sku != '' GROUP BY sku)"
+            )
+        for statement in INDEXES.strip().splitlines():
+            conn.execute(statement)
+        count = conn.execute('SELECT COUNT(*) FROM rows').fetchone()[0]
+        _set_meta(conn, 'fields', fields)
+        _set_meta(conn, 'sku_field', sku_field)
+        _set_meta(conn, 'count', count)
+        _set_meta(conn, 'dirty', True)
+    return count
+
+
+def _delete(conn, skus) -> int:
+    """Delete ``skus`` and keep the cached row count in step."""
+    with conn:
+        cur = conn.executemany('DELETE FROM rows WHERE sku = ?', ((s,) for s in skus))
+        deleted = cur.rowcount
+        if deleted:
+            _set_meta(conn, 'count', _get_meta(conn, 'count', 0) - deleted)
+            _set_meta(conn, 'dirty', True)
+    return deleted
+
+
+def _iter_rows(conn):
+    record = record_type(_get_meta(conn, 'fields', []))
+    width = len(record.fields)
+    for (data,) in conn.execute('SELECT data FROM rows ORDER BY id'):
+        yield record.from_strings(_values(data, width))
+
+
+def _prefix_bound(prefix: str) -> str:
+    """Smallest string greater than every string starting with ``prefix``."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _where(sku_prefix: str = None, upc: str = None, manufacturer: str = None,
+           sku: str = None) -> tuple:
+    clauses = []
+    params = []
+    if sku:
+        clauses.append('sku = ?')
+        params.append(sku)
+    if sku_prefix:
+        clauses.append('sku >= ? AND sku < ?')
+        params += [sku_prefix, _prefix_bound(sku_prefix)]
+    if upc:
+        clauses.append('upc = ?')
+        params.append(upc)
+    if manufacturer:
+        clauses.append('manufacturer = ? COLLATE NOCASE')
+        params.append(manufacturer)
+    return ' AND '.join(clauses) or '1', params
+
+
+def save_rows(name: str, rows, sku_field: str = 'SKU', duplicates: str = 'keep',
+              **options) -> int:
+    """Replace the catalog with ``rows``, export it and return the count.
+
+    Rows are indexed by ``sku_field`` and stored in feed order. By default
+    every row is kept, as in the feed; ``duplicates`` set to ``first`` or
+    ``last`` keeps only that row of a repeated SKU. Rows without a SKU are
+    never merged. ``options`` are passed to :func:`export_csv`.
+    """
+    with metrics.timed('catalog'), _store(name) as conn:
+        count = _replace(conn, rows, sku_field, duplicates)
+    metrics.add_rows('catalog', count)
+    with metrics.timed('export'):
+        export_csv(name, **options)
+    return count
+
+
+def load_rows(name: str) -> RowTable:
+    """All rows of the catalog as a columnar :class:`RowTable`."""
+    if not _exists(name):
+        return RowTable()
+    with _store(name) as conn:
+        return RowTable.from_rows(_iter_rows(conn))
+
+
+def get_row(name: str, sku: str):
+    """Return the first row stored for ``sku`` or ``None``."""
+    if not sku or not _exists(name):
+        return None
+    with _store(name) as conn:
+        row = conn.execute(
+            'SELECT data FROM rows WHERE sku = ? ORDER BY id LIMIT 1', (sku,)
+        ).fetchone()
+        if row is None:
+            return None
+        record = record_type(_get_meta(conn, 'fields', []))
+        return record.from_strings(_values(row[0], len(record.fields)))
+
+
+def count_rows(name: str, **filters) -> int:
+    """Number of rows in the catalog, read from cached metadata.
+
+    With :func:`query` filters the matching rows are counted on the index.
+    """
+    if not _exists(name):
+        return 0
+    with _store(name) as conn:
+        if not any(filters.values()):
+            return _get_meta(conn, 'count', 0)
+        where, params = _where(**filters)
+        return conn.execute(f'SELECT COUNT(*) FROM rows WHERE {where}', params).fetchone()[0]
+
+
+def query(name: str, sku_prefix: str = None, upc: str = None, manufacturer: str = None,
+          limit: int = None, sku: str = None):
+    """Yield the rows matching every given filter, in SKU order.
+
+    ``sku`` matches the SKU exactly and ``sku_prefix`` its start, ``upc``
+    the UPC exactly and ``manufacturer`` the manufacturer ignoring case;
+    each is answered from an index. Rows sharing a SKU come in feed order.
+    Rows are fetched a batch at a time so the catalog is never loaded whole
+    and other callers are not blocked while the caller iterates.
+    """
+    if not _exists(name):
         return
-    with open(path, 'w', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=rows[0].keys())
-        writer.writeheader()
-        for r in rows:
-            writer.writerow(r)
+    where, params = _where(sku_prefix, upc, manufacturer, sku)
+    after = None
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = BATCH_SIZE if remaining is None else min(BATCH_SIZE, remaining)
+        # Resume after the last row seen; ids order the rows of one SKU.
+        after_row = '1' if after is None else '(sku, id) > (?, ?)'
+        with _store(name) as conn:
+            record = record_type(_get_meta(conn, 'fields', []))
+            page = conn.execute(
+                f'SELECT sku, id, data FROM rows WHERE {where} AND {after_row} '
+                'ORDER BY sku, id LIMIT ?',
+                params + list(after or ()) + [size],
+            ).fetchall()
+        for _, _, data in page:
+            yield record.from_strings(_values(data, len(record.fields)))
+        if len(page) < size:
+            return
+        after = page[-1][:2]
+        if remaining is not None:
+            remaining -= len(page)
+
+
+def find_sku(name: str, sku: str) -> list:
+    """Rows whose SKU is ``sku``; none for an empty ``sku``."""
+    return list(query(name, sku=sku)) if sku else []
 
 
-def load_rows(name: str) -> list:
-    path = catalog_path(name)
-    if not os.path.exists(path):
-        return []
-    with open(path, newline='') as f:
-        return list(csv.DictReader(f))
+def find_upc(name: str, upc: str) -> list:
+    """Rows whose UPC is ``upc``; none for an empty ``upc``."""
+    return list(query(name, upc=upc)) if upc else []
 
 
-def delete_sku(name: str, sku: str) -> None:
-    rows = [r for r in load_rows(name) if r.get('SKU') != sku]
-    save_rows(name, rows)
+def export_csv(name: str, path: str = None, generations: int = 0,
+               compress: str = None) -> str:
+    """Write the catalog as CSV if it changed since the last export.
 
+    Passing an explicit ``path`` always writes a fresh copy there. The file
+    is replaced atomically, see :func:`outputs.atomic_open`.
+    """
+    target = path or catalog_path(name)
+    with _store(name) as conn:
+        if path is None and os.path.exists(target) and not _get_meta(conn, 'dirty', True):
+            return target
+        fields = _get_meta(conn, 'fields', [])
+        with outputs.atomic_open(target, 'w', generations, compress, newline='') as f:
+            if fields:
+                writer = csv.writer(f)
+                writer.writerow(fields)
+                # Stored rows are already in ``fields`` order.
+                writer.writerows(
+                    _values(data, len(fields))
+                    for (data,) in conn.execute('SELECT data FROM rows ORDER BY id')
+                )
+        if path is None:
+            with conn:
+                _set_meta(conn, 'dirty', False)
+    return target
 
-def delete_from_file(name: str, delete_file: str) -> None:
-    rows = load_rows(name)
-    deletes = set()
+
+def delete_sku(name: str, sku: str) -> bool:
+    """Delete every row of ``sku``; call :func:`export_csv` to refresh the CSV."""
+    if not sku or not _exists(name):
+        return False
+    with _store(name) as conn:
+        return _delete(conn, [sku]) > 0
+
+
+def _marked_skus(delete_file: str):
+    """Yield SKUs whose ``DELETE`` column is ``X`` in ``delete_file``."""
     with open(delete_file, newline='') as f:
         for row in csv.DictReader(f):
-            if row.get('DELETE', '').strip().upper() == 'X':
-                deletes.add(row.get('SKU'))
-    rows = [r for r in rows if r.get('SKU') not in deletes]
-    save_rows(name, rows)
+            if (row.get('DELETE') or '').strip().upper() == 'X' and row.get('SKU'):
+                yield row['SKU']
+
+
+def delete_from_file(name: str, delete_file: str) -> dict:
+    """Delete every SKU marked in ``delete_file`` and refresh the CSV export.
+
+    The file is streamed into a temporary table and joined against the SKU
+    index in one statement, so neither the catalog nor the delete list is
+    held in memory. Returns the number of distinct SKUs ``matched`` (and
+    deleted with all their rows) and ``unmatched``.
+    """
+    if not _exists(name):
+        return {'matched': 0, 'unmatched': 0}
+    with _store(name) as conn:
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS deletes (sku TEXT PRIMARY KEY) WITHOUT ROWID')
+        try:
+            with conn:
+                conn.execute('DELETE FROM temp.deletes')
+                skus = ((sku,) for sku in _marked_skus(delete_file))
+                while True:
+                    batch = list(islice(skus, BATCH_SIZE))
+                    if not batch:
+                        break
+                    conn.executemany('INSERT OR IGNORE INTO temp.deletes (sku) VALUES (?)', batch)
+                total = conn.execute('SELECT COUNT(*) FROM temp.deletes').fetchone()[0]
+                matched = conn.execute(
+                    'SELECT COUNT(*) FROM temp.deletes WHERE sku IN (SELECT sku FROM rows)'
+                ).fetchone()[0]
+                deleted = conn.execute(
+                    'DELETE FROM rows WHERE sku IN (SELECT sku FROM temp.deletes)'
+                ).rowcount
+                if deleted:
+                    _set_meta(conn, 'count', _get_meta(conn, 'count', 0) - deleted)
+                    _set_meta(conn, 'dirty', True)
+        finally:
+            conn.execute('DROP TABLE IF EXISTS temp.deletes')
+    export_csv(name)
+    return {'matched': matched, 'unmatched': total - matched}
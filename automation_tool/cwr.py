@@ -1,22 +1,77 @@
 import logging
-import csv
 import os
+import time
+from contextlib import contextmanager
 import urllib.request
-from datetime import datetime, timedelta
 from pathlib import Path
-from .base import Supplier
-from . import catalog
+from .base import Supplier, file_stat
+from . import catalog, metrics, outputs
+from .rows import record_type
 from inventory_processor import (
+    FEED_FIELDS,
+    OUTPUT_FIELDS,
+    NotModified,
     download_inventory,
     merge_mapping,
-    save_inventory,
+    write_inventory,
 )
 
 class CwrSupplier(Supplier):
     """CWR Distribution supplier implementation."""
-    def __init__(self):
-        super().__init__('CWR', 'cwr.json')
+    warehouse_regions = {'nj': ['qtynj'], 'fl': ['qtyfl']}
+    full_output = 'cwr_inventory_full.txt'
+    output_delimiter = '\t'
+    # merge_mapping already rewrites SKUs with the mapping file.
+    maps_output = True
 
+    def __init__(self, account: str = None):
+        super().__init__('CWR', 'cwr.json', account)
+
+    @contextmanager
+    def _validators(self, job: str, output: str, mapping_file: str = None, requires=()):
+        """Yield the HTTP validators recorded by the last successful ``job``.
+
+        They are dropped when ``output`` or a path in ``requires`` is missing
+        or the mapping file has changed, and stored again once the ``with``
+        block completes.
+        """
+        key = f'http:{job}'
+        mapping = file_stat(mapping_file)
+        validators = self.state.get(key) or {}
+        missing = not all(os.path.exists(p) for p in (output, *requires))
+        if missing or validators.get('mapping') != mapping:
+            validators = {}
+        validators = dict(validators, mapping=mapping)
+        yield validators
+        self.state.set(key, validators)
+
+    def _download(self, base_url: str, since: int, validators: dict = None):
+        """Stream the feed as compact records, timed as the download stage."""
+        return metrics.stage('download', download_inventory(
+            base_url, since, validators, timeout=self.timeout(), record=record_type(FEED_FIELDS),
+        ))
+
+    def output_fields(self) -> list:
+        """Columns of the TSV files, the script's unless ``output_price`` is set.
+
+        ``output_price`` appends ``Price`` so the unified merge can compare
+        CWR offers by price; it is off by default to keep the layout the
+        uploader expects.
+        """
+        value = str(self.get_credential('output_price', '')).strip().lower()
+        if value in ('1', 'true', 'yes', 'on'):
+            return OUTPUT_FIELDS + ['Price']
+        return OUTPUT_FIELDS
+
+    def _save(self, rows, output: str) -> int:
+        with metrics.timed('write'), outputs.atomic_open(
+            output, 'w', newline='', **self.output_options()
+        ) as f:
+            count = write_inventory(rows, f, self.output_fields())
+        metrics.add_rows('write', count)
+        return count
+
+    @metrics.instrument('inventory')
     def fetch_inventory(self) -> None:
         base_url = self.get_credential('base_url')
         mapping_file = self.get_credential('mapping_file')
@@ -25,30 +80,45 @@ class CwrSupplier(Supplier):
             logging.warning('CWR base_url credential missing')
             return
 
-        since = int((datetime.now() - timedelta(hours=10)).timestamp())
+        started = int(time.time())
+        since = self.incremental_since('inventory', started)
+        if not since:
+            logging.info('No recent CWR watermark, requesting the full feed')
         try:
-            rows = download_inventory(base_url, since)
+            rows = self._download(base_url, since)
+            rows = self.aggregate(rows)
             if mapping_file:
-                rows = merge_mapping(rows, Path(mapping_file))
-            save_inventory(rows, Path(output))
-            logging.info('Saved CWR inventory to %s', output)
+                rows = metrics.stage('mapping', merge_mapping(rows, Path(mapping_file)))
+            with self.track_delta(rows, output, full=False) as rows:
+                count = self._save(rows, output)
+            self.set_watermark('inventory', started)
+            logging.info('Saved %d CWR inventory rows changed since %s to %s', count, since, output)
         except Exception as exc:
             logging.exception('Failed to fetch CWR inventory: %s', exc)
 
+    @metrics.instrument('full')
     def fetch_inventory_full(self) -> None:
         """Force download the entire inventory feed."""
         base_url = self.get_credential('base_url')
         mapping_file = self.get_credential('mapping_file')
-        output = self.get_credential('full_output', 'cwr_inventory_full.txt')
+        output = self.get_credential('full_output', self.full_output)
         if not base_url:
             logging.warning('CWR base_url credential missing')
             return
+        started = int(time.time())
         try:
-            rows = download_inventory(base_url, 0)
-            if mapping_file:
-                rows = merge_mapping(rows, Path(mapping_file))
-            save_inventory(rows, Path(output))
-            logging.info('Saved CWR full inventory to %s', output)
+            with self._validators('inventory_full', output, mapping_file) as validators:
+                rows = self._download(base_url, 0, validators)
+                rows = self.aggregate(rows)
+                if mapping_file:
+                    rows = metrics.stage('mapping', merge_mapping(rows, Path(mapping_file)))
+                with self.track_delta(rows, output) as rows:
+                    count = self._save(rows, output)
+            # A full pull covers every change, so incremental pulls resume from it.
+            self.set_watermark('inventory', started)
+            logging.info('Saved %d CWR full inventory rows to %s', count, output)
+        except NotModified:
+            logging.info('CWR full inventory unchanged, skipping')
         except Exception as exc:
             logging.exception('Failed to fetch CWR full inventory: %s', exc)
 
@@ -69,6 +139,7 @@ class CwrSupplier(Supplier):
             logging.exception('CWR connection failed: %s', exc)
             print('Connection failed:', exc)
 
+    @metrics.instrument('catalog')
     def fetch_catalog(self) -> None:
         base_url = self.get_credential('base_url')
         mapping_file = self.get_credential('mapping_file')
@@ -80,16 +151,19 @@ class CwrSupplier(Supplier):
             return
         os.makedirs(out_dir, exist_ok=True)
         try:
-            rows = download_inventory(base_url, 0)
-            if mapping_file:
-                rows = merge_mapping(rows, Path(mapping_file))
-            catalog.save_rows(self.name, rows)
-            with open(output, 'w', newline='') as f:
-                writer = csv.DictWriter(f, fieldnames=rows[0].keys())
-                writer.writeheader()
-                writer.writerows(rows)
-            logging.info('Saved CWR catalog to %s', output)
+            with self._validators('catalog', output, mapping_file,
+                                  requires=[catalog.db_path(self.name)]) as validators:
+                rows = self._download(base_url, 0, validators)
+                if mapping_file:
+                    rows = metrics.stage('mapping', merge_mapping(rows, Path(mapping_file)))
+                options = self.output_options()
+                count = catalog.save_rows(self.name, rows, **options)
+                outputs.copy_file(catalog.catalog_path(self.name), output, **options)
+            logging.info('Saved %d CWR catalog rows to %s', count, output)
             print('Catalog saved to', catalog.catalog_path(self.name))
+        except NotModified:
+            logging.info('CWR catalog unchanged, skipping')
+            print('Catalog unchanged')
         except Exception as exc:
             logging.exception('Failed to fetch CWR catalog: %s', exc)
             print('Catalog download failed:', exc)
@@ -0,0 +1,138 @@
+"""Headless runner for the scheduled jobs defined in ``data/jobs.json``.
+
+Each definition names a registry supplier, an action from
+:data:`automation_tool.orchestrator.JOBS` and an interval in seconds::
+
+    [{"supplier": "keystone", "action": "inventory", "interval": 300},
+     {"supplier": "keystone", "account": "east", "action": "full", "interval": 86400}]
+
+Suppliers are constructed when their first job runs. ``SIGHUP`` re-reads
+the job file and supplier credentials; jobs already running are left to
+finish with the supplier and credentials they started with. ``SIGTERM`` and ``SIGINT`` stop scheduling and wait for them.
+"""
+
+import json
+import logging
+import os
+import signal
+import threading
+from . import registry
+from .base import DATA_DIR
+from .orchestrator import JOBS
+from .scheduler import SCHEDULER
+
+JOBS_PATH = os.path.join(DATA_DIR, 'jobs.json')
+
+# Job name -> definition of the jobs scheduled from the job file.
+_active = {}
+_lock = threading.Lock()
+
+
+def job_name(definition: dict) -> str:
+    supplier = definition['supplier']
+    if definition.get('account'):
+        supplier = f"{supplier}-{definition['account']}"
+    return f"{supplier}:{definition['action']}"
+
+
+def _valid(definition: dict) -> bool:
+    try:
+        interval = float(definition['interval'])
+        ok = (definition['supplier'] in registry.SUPPLIERS
+              and definition['action'] in JOBS and interval > 0)
+    except (KeyError, TypeError, ValueError):
+        ok = False
+    if not ok:
+        logging.error('Ignoring invalid job definition %r', definition)
+    return ok
+
+
+def load_jobs(path: str = JOBS_PATH) -> list:
+    """Valid job definitions from ``path``; a missing file means no jobs."""
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        definitions = json.load(f)
+    return [d for d in definitions if isinstance(d, dict) and _valid(d)]
+
+
+def save_jobs(definitions: list, path: str = JOBS_PATH) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(definitions, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _runner(definition: dict):
+    key = definition['supplier']
+    account = definition.get('account')
+    method = JOBS[definition['action']]
+
+    def run():
+        getattr(registry.get(key, account), method)()
+    return run
+
+
+def _schedule(scheduler, definition: dict) -> None:
+    name = job_name(definition)
+    scheduler.add_job(name, _runner(definition), float(definition['interval']))
+    _active[name] = definition
+
+
+def apply(definitions: list, scheduler=SCHEDULER) -> None:
+    """Make the scheduled file jobs match ``definitions``.
+
+    Unchanged jobs keep their place in the schedule; removed ones are
+    unscheduled without interrupting a run in progress.
+    """
+    wanted = {job_name(d): d for d in definitions}
+    with _lock:
+        for name in list(_active):
+            if name not in wanted:
+                scheduler.remove_job(name)
+                del _active[name]
+        for name, definition in wanted.items():
+            if _active.get(name) != definition:
+                _schedule(scheduler, definition)
+
+
+def schedule(key: str, action: str, interval: float, account: str = None,
+             path: str = JOBS_PATH, scheduler=SCHEDULER) -> None:
+    """Schedule a job now and save it to the job file for the daemon."""
+    definition = {'supplier': key, 'action': action, 'interval': interval}
+    if account:
+        definition['account'] = account
+    name = job_name(definition)
+    with _lock:
+        definitions = [d for d in load_jobs(path) if job_name(d) != name]
+        definitions.append(definition)
+        save_jobs(definitions, path)
+        _schedule(scheduler, definition)
+    scheduler.start()
+
+
+def run(path: str = JOBS_PATH, scheduler=SCHEDULER) -> int:
+    """Run the jobs in ``path`` until ``SIGTERM``/``SIGINT``."""
+    stop = threading.Event()
+    reload = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda *_: reload.set())
+
+    apply(load_jobs(path), scheduler)
+    scheduler.start()
+    logging.info('Daemon started with %d jobs from %s', len(_active), path)
+    while not stop.wait(1):
+        if reload.is_set():
+            reload.clear()
+            logging.info('Reloading %s', path)
+            try:
+                apply(load_jobs(path), scheduler)
+                registry.reload()
+            except Exception as exc:
+                logging.exception('Reload failed, keeping current jobs: %s', exc)
+    logging.info('Daemon stopping, waiting for running jobs')
+    scheduler.stop(wait=True)
+    return 0
@@ -0,0 +1,155 @@
+"""Snapshot inventory pulls and emit only the SKUs that changed."""
+
+import csv
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from .base import DATA_DIR
+
+SNAPSHOT_DIR = os.path.join(DATA_DIR, 'snapshots')
+
+DELTA_FIELDS = ['change', 'SKU', 'Quantity', 'Price']
+
+# Snapshot rows are written in batches of this size.
+BATCH_SIZE = 10000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS snapshot (
+    sku TEXT PRIMARY KEY,
+    digest BLOB NOT NULL,
+    quantity TEXT NOT NULL,
+    price TEXT NOT NULL,
+    gen INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+'''
+
+_locks = {}
+_lock = threading.Lock()
+
+
+def snapshot_path(name: str) -> str:
+    return os.path.join(SNAPSHOT_DIR, f"{name}.db")
+
+
+def delta_path(output: str) -> str:
+    """Delta file written next to an inventory ``output`` file."""
+    root, _ = os.path.splitext(str(output))
+    return f"{root}_delta.csv"
+
+
+def _digest(quantity: str, price: str) -> bytes:
+    return hashlib.blake2b(f"{quantity}\x1f{price}".encode('utf-8'), digest_size=8).digest()
+
+
+def _supplier_lock(name: str) -> threading.Lock:
+    with _lock:
+        return _locks.setdefault(name, threading.Lock())
+
+
+@contextmanager
+def track(name: str, rows, output: str, sku_field: str = 'SKU',
+          quantity_field: str = 'Quantity', price_field: str = 'Price',
+          full: bool = True):
+    """Yield ``rows`` wrapped to write their delta to ``output``.
+
+    Each row is compared against the stored snapshot by a digest of its
+    quantity and price, so only the snapshot index is consulted and nothing
+    is held in memory. ``full`` pulls also report SKUs missing from the feed
+    as removed. The snapshot and delta file are only updated when the
+    ``with`` block exits without raising after ``rows`` was exhausted, so
+    the caller writes its own output inside the block and a pull whose
+    output was not written is compared again next time. An empty or
+    interrupted pull leaves both untouched.
+    """
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    tmp = f"{output}.tmp"
+    with _supplier_lock(name):
+        conn = sqlite3.connect(snapshot_path(name), timeout=600)
+        try:
+            conn.executescript(SCHEMA)
+            counts = {}
+            tracked = _compare(name, conn, rows, tmp, counts, sku_field, quantity_field,
+                               price_field, full)
+            try:
+                yield tracked
+            finally:
+                tracked.close()
+            if not counts:
+                conn.rollback()
+                return
+            os.replace(tmp, output)
+            conn.commit()
+            logging.info(
+                'Wrote %s delta to %s: %d added, %d changed, %d removed',
+                name, output, counts['added'], counts['changed'], counts['removed'],
+            )
+        finally:
+            conn.close()
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+def _compare(name, conn, rows, tmp, counts, sku_field, quantity_field, price_field, full):
+    """Yield ``rows``, staging snapshot updates in ``conn`` and the delta in ``tmp``.
+
+    ``counts`` is filled in only once every row has been compared.
+    """
+    row = conn.execute("SELECT value FROM meta WHERE key = 'gen'").fetchone()
+    gen = (row[0] if row else 0) + 1
+    changes = {'added': 0, 'changed': 0, 'removed': 0}
+    seen = 0
+    with open(tmp, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(DELTA_FIELDS)
+        batch = []
+        for r in rows:
+            sku = r.get(sku_field)
+            if sku:
+                seen += 1
+                quantity = str(r.get(quantity_field, ''))
+                price = str(r.get(price_field, ''))
+                digest = _digest(quantity, price)
+                old = conn.execute(
+                    'SELECT digest FROM snapshot WHERE sku = ?', (sku,)
+                ).fetchone()
+                if old is None or old[0] != digest:
+                    change = 'added' if old is None else 'changed'
+                    changes[change] += 1
+                    writer.writerow([change, sku, quantity, price])
+                batch.append((sku, digest, quantity, price, gen))
+                if len(batch) >= BATCH_SIZE:
+                    _upsert(conn, batch)
+                    batch = []
+            yield r
+        if batch:
+            _upsert(conn, batch)
+        if not seen:
+            logging.info('No rows for %s delta, snapshot unchanged', name)
+            return
+        if full:
+            removed = conn.execute(
+                'SELECT sku, quantity, price FROM snapshot WHERE gen < ?', (gen,)
+            )
+            for sku, quantity, price in removed:
+                changes['removed'] += 1
+                writer.writerow(['removed', sku, quantity, price])
+            conn.execute('DELETE FROM snapshot WHERE gen < ?', (gen,))
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('gen', ?)", (gen,)
+        )
+    counts.update(changes)
+
+
+def _upsert(conn, batch: list) -> None:
+    conn.executemany(
+        'INSERT OR REPLACE INTO snapshot (sku, digest, quantity, price, gen) '
+        'VALUES (?, ?, ?, ?, ?)',
+        batch,
+    )
@@ -0,0 +1,266 @@
+"""Reusable FTP/FTPS sessions with resumable downloads."""
+
+import calendar
+import ftplib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from . import metrics, outputs
+
+# Socket timeout for control and data connections.
+TIMEOUT = 60
+# Seconds between NOOPs sent to idle sessions.
+KEEPALIVE = 60
+# Idle sessions older than this are logged out instead of kept alive.
+MAX_IDLE = 30 * 60
+# Attempts per download; each retry resumes from the bytes already written.
+RETRIES = 3
+
+
+class FtpPool:
+    """Keep logged-in sessions per server and account between runs."""
+    def __init__(self, keepalive: int = KEEPALIVE, max_idle: int = MAX_IDLE):
+        self.keepalive_interval = keepalive
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._keepalive_thread = None
+
+    def _connect(self, host, port, user, password, protocol, timeout=TIMEOUT):
+        ftp = ftplib.FTP() if protocol == 'ftp' else ftplib.FTP_TLS()
+        ftp.connect(host, port, timeout=timeout)
+        ftp.login(user, password)
+        if isinstance(ftp, ftplib.FTP_TLS):
+            ftp.prot_p()
+        return ftp
+
+    def _checkout(self, key: tuple, timeout: float = TIMEOUT):
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                if not idle:
+                    break
+                ftp, _ = idle.pop()
+            # A pooled session may have been opened with another timeout;
+            # data connections read ``ftp.timeout`` when they are opened.
+            ftp.timeout = timeout
+            try:
+                ftp.sock.settimeout(timeout)
+                ftp.voidcmd('NOOP')
+                return ftp
+            except (*ftplib.all_errors, AttributeError):
+                _close(ftp)
+        return self._connect(*key, timeout)
+
+    def _checkin(self, key: tuple, ftp) -> None:
+        with self._lock:
+            self._idle.setdefault(key, []).append((ftp, time.monotonic()))
+            if self._keepalive_thread is None:
+                self._keepalive_thread = threading.Thread(
+                    target=self._keepalive_loop, name='ftp-keepalive', daemon=True
+                )
+                self._keepalive_thread.start()
+
+    def _keepalive_loop(self) -> None:
+        while True:
+            time.sleep(self.keepalive_interval)
+            self.keepalive()
+
+    def keepalive(self) -> None:
+        """NOOP idle sessions, dropping dead ones and those idle too long."""
+        now = time.monotonic()
+        with self._lock:
+            pools, self._idle = self._idle, {}
+        for key, idle in pools.items():
+            for ftp, since in idle:
+                if now - since > self.max_idle:
+                    _close(ftp)
+                    continue
+                try:
+                    ftp.voidcmd('NOOP')
+                except ftplib.all_errors:
+                    _close(ftp)
+                    continue
+                with self._lock:
+                    self._idle.setdefault(key, []).append((ftp, since))
+
+    def close(self) -> None:
+        """Log out of every idle session."""
+        with self._lock:
+            pools, self._idle = self._idle, {}
+        for idle in pools.values():
+            for ftp, _ in idle:
+                _close(ftp)
+
+    @contextmanager
+    def session(self, host: str, user: str, password: str, port: int = 21,
+                protocol: str = 'ftps', timeout: float = TIMEOUT):
+        """Yield a logged-in session, returning it to the pool afterwards.
+
+        ``timeout`` bounds each blocking socket operation. A session that
+        raised is closed rather than reused.
+        """
+        key = (host, int(port), user, password, protocol.lower())
+        ftp = self._checkout(key, float(timeout))
+        try:
+            yield ftp
+        except BaseException:
+            _close(ftp)
+            raise
+        self._checkin(key, ftp)
+
+    def download(self, remote: str, output: str, previous: dict = None,
+                 retries: int = RETRIES, generations: int = 0, compress: str = None,
+                 ticket=None, **credentials):
+        """Download ``remote`` to ``output`` atomically, resuming on failure.
+
+        Returns the remote ``MDTM``/``SIZE`` as a dict, or ``None`` without
+        transferring anything when they equal ``previous`` and ``output``
+        already exists.
+
+        Data goes to ``output + '.part'``; after a dropped connection the
+        transfer restarts with ``REST`` at the current size of that file. A
+        partial file left by an earlier run is resumed only when the remote
+        MDTM and SIZE equal those recorded when it was started, and is
+        discarded otherwise. The finished file is renamed into place so
+        readers never see a truncated ``output``; ``generations`` and
+        ``compress`` are applied as by :mod:`.outputs`.
+
+        ``ticket`` is the :class:`~.resilience.Ticket` of a hedged download.
+        It is checked after every block, so the transfer stops with
+        ``Cancelled`` once the other racer has won, and the win is claimed
+        just before the rename. Such a download writes a part file of its
+        own, removed when it does not finish, so a later run never resumes it.
+        """
+        outputs.check_compress(compress)
+        with metrics.timed('download'):
+            return self._download(remote, output, previous, retries, credentials,
+                                  generations, compress, ticket)
+
+    def _download(self, remote, output, previous, retries, credentials, generations, compress,
+                  ticket=None):
+        if ticket is None:
+            return self._transfer(remote, output, f'{output}.part', previous, retries,
+                                  credentials, generations, compress)
+        part = f'{output}.{os.getpid()}.{threading.get_ident()}.part'
+        try:
+            return self._transfer(remote, output, part, previous, retries, credentials,
+                                  generations, compress, ticket)
+        finally:
+            _discard(part)
+
+    def _transfer(self, remote, output, part, previous, retries, credentials, generations,
+                  compress, ticket=None):
+        attempt = 0
+        stat = None
+        while True:
+            try:
+                with self.session(**credentials) as ftp:
+                    if stat is None:
+                        stat = remote_stat(ftp, remote)
+                        if _unchanged(stat, previous) and os.path.exists(output):
+                            return None
+                        offset = _resume_offset(part, stat)
+                    else:
+                        offset = _size(part)
+                    with open(part, 'ab' if offset else 'wb') as f:
+                        if offset:
+                            logging.info('Resuming %s at byte %d', remote, offset)
+
+                        def write(block):
+                            if ticket is not None:
+                                ticket.check()
+                            f.write(block)
+                            metrics.add_bytes('download', len(block))
+                        ftp.retrbinary(f'RETR {remote}', write, rest=offset or None)
+                break
+            except ftplib.error_perm:
+                raise
+            except ftplib.all_errors as exc:
+                attempt += 1
+                if attempt >= retries:
+                    raise
+                logging.warning('FTP download of %s failed (%r), retrying', remote, exc)
+                time.sleep(2 ** attempt)
+        if ticket is not None:
+            ticket.win()
+        outputs.commit(part, output, generations, compress)
+        _discard(part)
+        return stat
+
+
+def remote_stat(ftp, remote: str) -> dict:
+    """Remote modification time and size; unsupported values are ``None``."""
+    stat = {'mdtm': None, 'size': None}
+    ftp.voidcmd('TYPE I')
+    try:
+        stat['mdtm'] = _mdtm(ftp, remote)
+    except (ftplib.error_perm, ValueError):
+        pass
+    try:
+        stat['size'] = ftp.size(remote)
+    except ftplib.error_perm:
+        pass
+    return stat
+
+
+def _unchanged(stat: dict, previous: dict) -> bool:
+    if not previous or previous.get('mdtm') is None and previous.get('size') is None:
+        return False
+    return stat == previous
+
+
+def _close(ftp) -> None:
+    try:
+        ftp.quit()
+    except Exception:
+        ftp.close()
+
+
+def _size(path: str) -> int:
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def _resume_offset(part: str, stat: dict) -> int:
+    """Size of a leftover partial download that is safe to resume, else 0.
+
+    ``part + '.stat'`` holds the remote MDTM/SIZE the partial file was
+    started from; it is resumed only when both are known and unchanged.
+    Otherwise ``stat`` is recorded there for the download starting over.
+    """
+    offset = _size(part)
+    if offset and stat['mdtm'] is not None and stat['size'] is not None \
+            and offset <= stat['size'] and _part_stat(part) == stat:
+        return offset
+    with open(f'{part}.stat', 'w') as f:
+        json.dump(stat, f)
+    return 0
+
+
+def _part_stat(part: str):
+    try:
+        with open(f'{part}.stat', 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _discard(part: str) -> None:
+    """Remove ``part`` and its recorded remote stat, whichever exist."""
+    for path in (part, f'{part}.stat'):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _mdtm(ftp, remote: str) -> float:
+    """Remote modification time as a UNIX timestamp (MDTM replies in UTC)."""
+    reply = ftp.voidcmd(f'MDTM {remote}')
+    return calendar.timegm(time.strptime(reply[4:18], '%Y%m%d%H%M%S'))
+
+
+POOL = FtpPool()
@@ -1,234 +1,252 @@
 import logging
-import urllib.request
 import xml.etree.ElementTree as ET
 import csv
+import io
 import os
+import shutil
 from .base import Supplier
-from . import catalog
-
-
-def _parse_dataset(xml_data: bytes) -> list:
-    """Parse Keystone SOAP dataset XML into rows."""
+from .rows import RowTable, record_type
+from . import catalog, metrics, outputs, parallel, resilience, soap
+
+
+KEYSTONE = soap.Service(
+    'http://order.ekeystone.com/wselectronicorder/electronicorder.asmx',
+    'http://eKeystone.com',
+    'ekey',
+)
+
+DIFFGRAM_TAG = '{urn:schemas-microsoft-com:xml-diffgram-v1}diffgram'
+
+
+def _iter_dataset(source):
+    """Yield Keystone SOAP dataset rows one ``Table`` element at a time.
+
+    ``source`` is a filename or binary file-like object such as an HTTP
+    response; it is consumed incrementally and finished rows are cleared so
+    memory stays flat regardless of the size of the dataset. Rows are
+    :class:`~automation_tool.rows.Record` mappings with numeric quantities
+    and prices.
+    """
+    path = []
+    dataset = None
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == 'NewDataSet' and path and path[-1] == DIFFGRAM_TAG:
+                dataset = elem
+            path.append(elem.tag)
+            continue
+        path.pop()
+        if elem is dataset:
+            dataset = None
+        elif elem.tag == 'Table' and dataset is not None and path[-1] == 'NewDataSet':
+            record = record_type(tuple(child.tag for child in elem))
+            yield record.from_strings([child.text or '' for child in elem])
+            dataset.clear()
+
+
+def _parse_dataset(xml_data: bytes) -> RowTable:
+    """Parse Keystone SOAP dataset XML into a columnar table of rows."""
     try:
-        root = ET.fromstring(xml_data)
+        return RowTable.from_rows(_iter_dataset(io.BytesIO(xml_data)))
     except ET.ParseError:
-        return []
-
-    diffgram = root.find('.//{urn:schemas-microsoft-com:xml-diffgram-v1}diffgram')
-    if diffgram is None:
-        return []
-    dataset = diffgram.find('NewDataSet')
-    if dataset is None:
-        return []
-    rows = []
-    for table in dataset.findall('Table'):
-        row = {child.tag: (child.text or '') for child in table}
-        rows.append(row)
-    return rows
+        return RowTable()
+
+
+def _write_rows(rows, output: str, **options) -> int:
+    """Write rows to ``output`` as CSV while they arrive, returning the count.
+
+    The file is written through :func:`outputs.atomic_open` with ``options``
+    and only once the first row is available, so an empty or failed
+    response leaves any previous output untouched.
+    """
+    rows = iter(rows)
+    with metrics.timed('write'):
+        first = next(rows, None)
+        if first is None:
+            return 0
+        count = 1
+        with outputs.atomic_open(output, 'w', newline='', **options) as f:
+            writer = csv.DictWriter(f, fieldnames=list(first.keys()), restval='')
+            writer.writeheader()
+            writer.writerow(first)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+    metrics.add_rows('write', count)
+    return count
 
 class KeystoneSupplier(Supplier):
     """Keystone Automotive supplier implementation."""
-    def __init__(self):
-        super().__init__('Keystone', 'keystone.json')
+    sku_field = 'VCPN'
+    quantity_field = 'TotalQty'
+    price_field = 'Cost'
+    # Every per-warehouse ``...Qty`` column is its own region.
+    warehouse_regions = 'auto'
+    full_output = 'keystone_inventory_full.csv'
+
+    def __init__(self, account: str = None):
+        super().__init__('Keystone', 'keystone.json', account)
 
     # Primary method: SOAP API inventory tracking
-    def fetch_inventory_primary(self) -> bool:
-        """Retrieve incremental inventory with warehouse breakdown."""
+    def fetch_inventory_primary(self, ticket=None) -> bool:
+        """Retrieve incremental inventory with warehouse breakdown.
+
+        ``ticket`` is the :class:`~.resilience.Ticket` of a hedged call.
+        """
         account = self.get_credential('account_number')
         key = self.get_credential('security_key')
         output = self.get_credential('output', 'keystone_inventory_update.csv')
         if not account or not key:
             logging.warning('Keystone credentials missing')
-            return
+            return False
+
+        def pull():
+            with KEYSTONE.call('GetInventoryUpdates', key, account, timeout=self.timeout()) as resp:
+                rows = metrics.stage('parse', _iter_dataset(resp))
+                if ticket is not None:
+                    rows = ticket.guard(rows)
+                with self.track_delta(self.aggregate(rows), output, full=False) as rows:
+                    return _write_rows(rows, output, **self.output_options())
 
-        envelope = f'''<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ekey="http://eKeystone.com">
-  <soapenv:Header/>
-  <soapenv:Body>
-    <ekey:GetInventoryUpdates>
-      <ekey:Key>{key}</ekey:Key>
-      <ekey:FullAccountNo>{account}</ekey:FullAccountNo>
-    </ekey:GetInventoryUpdates>
-  </soapenv:Body>
-</soapenv:Envelope>'''
-
-        req = urllib.request.Request(
-            'http://order.ekeystone.com/wselectronicorder/electronicorder.asmx',
-            data=envelope.encode('utf-8'),
-            headers={
-                'Content-Type': 'text/xml; charset=utf-8',
-                'SOAPAction': 'http://eKeystone.com/GetInventoryUpdates',
-            },
-        )
         try:
-            with urllib.request.urlopen(req) as resp:
-                xml_data = resp.read()
-            rows = _parse_dataset(xml_data)
-            if rows:
-                with open(output, 'w', newline='') as f:
-                    writer = csv.DictWriter(f, fieldnames=rows[0].keys())
-                    writer.writeheader()
-                    writer.writerows(rows)
-                logging.info('Saved Keystone inventory update to %s', output)
+            count = self.call_endpoint(KEYSTONE.url, pull)
+            if count:
+                logging.info('Saved %d Keystone inventory update rows to %s', count, output)
                 return True
             logging.warning('No data returned from Keystone update')
+        except resilience.CircuitOpen:
+            logging.warning('Keystone SOAP endpoint is failing, skipping it')
+        except resilience.Cancelled:
+            logging.info('Keystone SOAP update superseded by FTP')
         except Exception as exc:
             logging.exception('Failed to fetch Keystone inventory: %s', exc)
         return False
 
     # Backwards compatible alias
+    @metrics.instrument('inventory')
     def fetch_inventory(self) -> None:
-        if not self.fetch_inventory_primary():
-            logging.info('Falling back to Keystone FTP inventory update')
-            self.fetch_inventory_secondary()
+        self.failover(self.fetch_inventory_primary, self.fetch_inventory_secondary)
 
     # Secondary method: FTP download
-    def fetch_inventory_secondary(self) -> None:
+    def fetch_inventory_secondary(self, ticket=None) -> bool:
         """Retrieve the inventory update file via FTP."""
-        ftp = self._ftp_connect()
+        credentials = self._ftp_credentials()
         remote_file = self.get_credential('remote_update_file', 'inventory_update.csv')
         output = self.get_credential('output', 'keystone_inventory_ftp.csv')
-        if not ftp:
+        if not credentials:
             logging.warning('Keystone FTP credentials missing')
-            return
+            return False
         try:
-            with open(output, 'wb') as f:
-                ftp.retrbinary(f'RETR {remote_file}', f.write)
-            logging.info('Downloaded Keystone inventory update via FTP to %s', output)
+            # SOAP may write the same file, so a hedged download only replaces
+            # it once it has won the race.
+            if ticket is not None:
+                ticket.check()
+            with self.conditional_ftp('inventory_update', remote_file, output, credentials,
+                                      ticket=ticket) as changed:
+                if not changed:
+                    if ticket is not None:
+                        ticket.win()
+                    logging.info('Keystone FTP inventory update unchanged, skipping')
+                    return True
+                logging.info('Downloaded Keystone inventory update via FTP to %s', output)
+                return True
+        except resilience.Cancelled:
+            logging.info('Keystone FTP update superseded by SOAP')
         except Exception as exc:
             logging.exception('Failed to fetch Keystone FTP inventory: %s', exc)
-        finally:
-            try:
-                ftp.quit()
-            except Exception:
-                pass
+        return False
 
+    @metrics.instrument('full')
     def fetch_inventory_full(self) -> None:
         """Retrieve the full Keystone inventory and store it as CSV."""
         account = self.get_credential('account_number')
         key = self.get_credential('security_key')
-        output = self.get_credential('full_output', 'keystone_inventory_full.csv')
+        output = self.get_credential('full_output', self.full_output)
         if not account or not key:
             logging.warning('Keystone credentials missing')
             return
 
-        envelope = f'''<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ekey="http://eKeystone.com">
-  <soapenv:Header/>
-  <soapenv:Body>
-    <ekey:GetInventoryFull>
-      <ekey:Key>{key}</ekey:Key>
-      <ekey:FullAccountNo>{account}</ekey:FullAccountNo>
-    </ekey:GetInventoryFull>
-  </soapenv:Body>
-</soapenv:Envelope>'''
-
-        req = urllib.request.Request(
-            'http://order.ekeystone.com/wselectronicorder/electronicorder.asmx',
-            data=envelope.encode('utf-8'),
-            headers={
-                'Content-Type': 'text/xml; charset=utf-8',
-                'SOAPAction': 'http://eKeystone.com/GetInventoryFull',
-            },
-        )
+        def pull():
+            with KEYSTONE.call('GetInventoryFull', key, account, timeout=self.timeout()) as resp:
+                rows = self.aggregate(metrics.stage('parse', _iter_dataset(resp)))
+                with self.track_delta(rows, output) as rows:
+                    return _write_rows(rows, output, **self.output_options())
+
         try:
-            with urllib.request.urlopen(req) as resp:
-                xml_data = resp.read()
-            rows = _parse_dataset(xml_data)
-            if rows:
-                with open(output, 'w', newline='') as f:
-                    writer = csv.DictWriter(f, fieldnames=rows[0].keys())
-                    writer.writeheader()
-                    writer.writerows(rows)
-                logging.info('Saved Keystone full inventory to %s', output)
+            count = self.call_endpoint(KEYSTONE.url, pull)
+            if count:
+                logging.info('Saved %d Keystone full inventory rows to %s', count, output)
             else:
                 logging.warning('No data returned from Keystone')
         except Exception as exc:
             logging.exception('Failed to fetch Keystone full inventory: %s', exc)
 
-    def _ftp_connect(self):
+    def _ftp_credentials(self):
+        """FTP login as keyword arguments for the session pool, or ``None``."""
         host = self.get_credential('ftp_host')
         user = self.get_credential('ftp_user')
         password = self.get_credential('ftp_password')
-        port = int(self.get_credential('ftp_port', 21))
-        protocol = self.get_credential('ftp_protocol', 'ftps').lower()
         if not host or not user or not password:
             return None
-        try:
-            import ftplib
-            if protocol == 'ftp':
-                ftp = ftplib.FTP()
-            else:
-                ftp = ftplib.FTP_TLS()
-            ftp.connect(host, port, timeout=10)
-            ftp.login(user, password)
-            if isinstance(ftp, ftplib.FTP_TLS):
-                ftp.prot_p()
-            return ftp
-        except Exception as exc:
-            logging.exception('Keystone FTP connection failed: %s', exc)
-            return None
+        return {
+            'host': host,
+            'user': user,
+            'password': password,
+            'port': int(self.get_credential('ftp_port', 21)),
+            'protocol': self.get_credential('ftp_protocol', 'ftps').lower(),
+            'timeout': self.timeout(),
+        }
 
     def test_connection(self) -> None:
         """Test SOAP and optionally FTP connectivity."""
-        ftp = self._ftp_connect()
-        if ftp:
-            ftp.quit()
-            print('FTP connection successful')
-            logging.info('Keystone FTP connection successful')
-            return
+        credentials = self._ftp_credentials()
+        if credentials:
+            from .ftpsession import POOL
+            try:
+                with POOL.session(**credentials) as ftp:
+                    ftp.voidcmd('NOOP')
+                print('FTP connection successful')
+                logging.info('Keystone FTP connection successful')
+                return
+            except Exception as exc:
+                logging.exception('Keystone FTP connection failed: %s', exc)
 
         try:
-            with urllib.request.urlopen(
-                'http://order.ekeystone.com/wselectronicorder/electronicorder.asmx',
-                timeout=10,
-            ) as resp:
-                if resp.status == 200:
-                    print('Connection successful')
-                    logging.info('Keystone SOAP connection successful')
-                else:
-                    print('Connection failed: status', resp.status)
-                    logging.warning(
-                        'Keystone SOAP connection failed status %s', resp.status
-                    )
+            KEYSTONE.ping(timeout=10)
+            print('Connection successful')
+            logging.info('Keystone SOAP connection successful')
+        except soap.SoapError as exc:
+            print('Connection failed: status', exc.status)
+            logging.warning('Keystone SOAP connection failed status %s', exc.status)
         except Exception as exc:
             logging.exception('Keystone SOAP connection failed: %s', exc)
             print('Connection failed:', exc)
 
+    @metrics.instrument('catalog')
     def fetch_catalog(self) -> None:
-        """Download the full catalog via SOAP and store it."""
+        """Download the full catalog via SOAP and load its rows into the store."""
         account = self.get_credential('account_number')
         key = self.get_credential('security_key')
         out_dir = self.get_credential('catalog_dir', '.')
         name = self.get_credential('catalog_name', 'keystone_catalog.xml')
+        mapping_file = self.get_credential('mapping_file')
+        sku_field = self.get_credential('sku_field', self.sku_field)
         output = os.path.join(out_dir, name)
         if not account or not key:
             logging.warning('Keystone credentials missing')
             return
         os.makedirs(out_dir, exist_ok=True)
-        envelope = f'''<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ekey="http://eKeystone.com">
-  <soapenv:Header/>
-  <soapenv:Body>
-    <ekey:GetInventoryQuantityFull>
-      <ekey:Key>{key}</ekey:Key>
-      <ekey:FullAccountNo>{account}</ekey:FullAccountNo>
-    </ekey:GetInventoryQuantityFull>
-  </soapenv:Body>
-</soapenv:Envelope>'''
-        req = urllib.request.Request(
-            'http://order.ekeystone.com/wselectronicorder/electronicorder.asmx',
-            data=envelope.encode('utf-8'),
-            headers={
-                'Content-Type': 'text/xml; charset=utf-8',
-                'SOAPAction': 'http://eKeystone.com/GetInventoryQuantityFull',
-            },
-        )
+        options = self.output_options()
         try:
-            with urllib.request.urlopen(req) as resp:
-                data = resp.read()
-            with open(output, 'wb') as f:
-                f.write(data)
+            with KEYSTONE.call('GetInventoryQuantityFull', key, account, timeout=self.timeout()) as resp:
+                with outputs.atomic_open(output, 'wb', **options) as f:
+                    shutil.copyfileobj(resp, f)
             logging.info('Downloaded Keystone catalog to %s', output)
-            # placeholder parse: store minimal row
-            catalog.save_rows(self.name, [{'SKU': 'sample', 'DATA': 'see file'}])
+            rows = parallel.iter_dataset(output, self.parse_workers(), sku_field=sku_field,
+                                         mapping_file=mapping_file)
+            count = catalog.save_rows(self.name, metrics.stage('parse', rows),
+                                      sku_field=sku_field, **options)
+            logging.info('Saved %d Keystone catalog rows', count)
             print('Catalog saved to', catalog.catalog_path(self.name))
         except Exception as exc:
             logging.exception('Failed to fetch Keystone catalog: %s', exc)
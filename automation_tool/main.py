@@ -1,14 +1,13 @@
+import argparse
 import logging
 import os
+import sys
 """Console entry point for the automation tool."""
 
-from automation_tool import (
-    KeystoneSupplier,
-    CwrSupplier,
-    SeawideSupplier,
-)
-from automation_tool.scheduler import RepeatedTimer
-from automation_tool import catalog
+from automation_tool.scheduler import SCHEDULER
+# Supplier, protocol and storage modules are imported when a command needs
+# them so one-shot commands start quickly.
+from automation_tool import daemon, metrics, orchestrator, registry, unified
 
 logging.basicConfig(
     filename='automation.log',
@@ -16,10 +15,11 @@ logging.basicConfig(
     format='%(asctime)s %(levelname)s %(message)s'
 )
 
+# Menu choice -> registry key; suppliers are constructed when selected.
 SUPPLIERS = {
-    '1': KeystoneSupplier(),
-    '2': CwrSupplier(),
-    '3': SeawideSupplier(),
+    '1': 'keystone',
+    '2': 'cwr',
+    '3': 'seawide',
 }
 
 # Available schedule intervals (label, seconds)
@@ -30,49 +30,74 @@ SCHEDULES = {
     '4': ("1 week", 7 * 24 * 60 * 60),
 }
 
-catalog_jobs = {}
-jobs = {}
+def schedule_job(key, action, interval):
+    daemon.schedule(key, action, interval, scheduler=SCHEDULER)
+
+# Rows printed for a catalog search.
+SEARCH_LIMIT = 20
+
 
-def schedule_function(name, func, interval, store):
-    if name in store:
-        store[name].stop()
-    timer = RepeatedTimer(interval, func)
-    timer.start()
-    store[name] = timer
-    logging.info("Scheduled %s every %s seconds", name, interval)
+def print_rows(rows):
+    for row in rows:
+        print(', '.join(f'{k}={v}' for k, v in row.items()))
 
-def schedule_supplier(supplier, interval):
-    schedule_function(supplier.name, supplier.fetch_inventory, interval, jobs)
 
-def schedule_catalog(supplier, interval):
-    if hasattr(supplier, 'fetch_catalog'):
-        schedule_function(f'{supplier.name}_catalog', supplier.fetch_catalog, interval, catalog_jobs)
+def prompt(label):
+    """Ask for ``label`` until something other than blanks is entered."""
+    while True:
+        value = input(label).strip()
+        if value:
+            return value
+
 
 def show_catalog_menu(supplier):
+    from automation_tool import catalog
     name = supplier.name
     while True:
-        rows = catalog.load_rows(name)
-        print(f"\nCatalog for {name} - {len(rows)} rows")
+        print(f"\nCatalog for {name} - {catalog.count_rows(name)} rows")
         print("1. Delete SKU")
         print("2. Delete via File")
-        print("3. Back")
+        print("3. Look Up SKU or UPC")
+        print("4. Search by SKU Prefix")
+        print("5. Search by Manufacturer")
+        print("6. Back")
         choice = input("Select option: ")
         if choice == '1':
             sku = input('SKU to delete: ')
-            catalog.delete_sku(name, sku)
-            print('Deleted', sku)
+            if catalog.delete_sku(name, sku):
+                print('Deleted', sku)
+            else:
+                print('SKU not found:', sku)
         elif choice == '2':
             path = input('Delete file path: ')
-            catalog.delete_from_file(name, path)
-            print('Processed delete file')
+            result = catalog.delete_from_file(name, path)
+            print('Processed delete file,', result['matched'], 'SKUs deleted,',
+                  result['unmatched'], 'SKUs not in catalog')
         elif choice == '3':
+            value = prompt('SKU or UPC: ')
+            rows = catalog.find_sku(name, value) or catalog.find_upc(name, value)
+            if rows:
+                print_rows(rows)
+            else:
+                print('Not found:', value)
+        elif choice in ('4', '5'):
+            if choice == '4':
+                filters = {'sku_prefix': prompt('SKU prefix: ')}
+            else:
+                filters = {'manufacturer': prompt('Manufacturer: ')}
+            total = catalog.count_rows(name, **filters)
+            print_rows(catalog.query(name, limit=SEARCH_LIMIT, **filters))
+            print(f'{total} matching rows' + (f', first {SEARCH_LIMIT} shown' if total > SEARCH_LIMIT else ''))
+        elif choice == '6':
+            catalog.export_csv(name)
             break
         else:
             print('Invalid option')
 
 
 def show_supplier_menu(key):
-    supplier = SUPPLIERS[key]
+    key = SUPPLIERS[key]
+    supplier = registry.get(key)
     while True:
         print(f"\nSupplier: {supplier.name}")
         opts = {}
@@ -116,7 +141,7 @@ def show_supplier_menu(key):
                 print(f"{n}. {label}")
             opt = input("Choice: ")
             if opt in SCHEDULES:
-                schedule_supplier(supplier, SCHEDULES[opt][1])
+                schedule_job(key, 'inventory', SCHEDULES[opt][1])
         elif action == 'sch_inv_full':
             if hasattr(supplier, 'fetch_inventory_full'):
                 print("Select schedule interval:")
@@ -124,7 +149,7 @@ def show_supplier_menu(key):
                     print(f"{n}. {label}")
                 opt = input("Choice: ")
                 if opt in SCHEDULES:
-                    schedule_function(f'{supplier.name}_full', supplier.fetch_inventory_full, SCHEDULES[opt][1], jobs)
+                    schedule_job(key, 'full', SCHEDULES[opt][1])
         elif action == 'cat':
             supplier.fetch_catalog()
         elif action == 'sch_cat':
@@ -133,7 +158,7 @@ def show_supplier_menu(key):
                 print(f"{n}. {label}")
             opt = input("Choice: ")
             if opt in SCHEDULES:
-                schedule_catalog(supplier, SCHEDULES[opt][1])
+                schedule_job(key, 'catalog', SCHEDULES[opt][1])
         elif action == 'manage_cat':
             show_catalog_menu(supplier)
         elif action == 'test':
@@ -142,19 +167,121 @@ def show_supplier_menu(key):
             print("Invalid option")
 
 
-def main():
+def run_all_command(args) -> int:
+    jobs = [j.strip() for j in args.jobs.split(',') if j.strip()]
+    unknown = [j for j in jobs if j not in orchestrator.JOBS]
+    if unknown:
+        print('Unknown job:', ', '.join(unknown))
+        return 2
+    results = orchestrator.run_all(
+        suppliers=args.supplier,
+        jobs=jobs,
+        max_workers=args.workers,
+        per_supplier=args.per_supplier,
+        accounts=args.accounts,
+    )
+    failed = 0
+    for name, job, elapsed, error in results:
+        status = 'failed: %s' % error if error else 'ok'
+        print(f"{name} {job}: {status} ({elapsed:.1f}s)")
+        failed += error is not None
+    return 1 if failed else 0
+
+
+def fetch_command(args) -> int:
+    supplier = registry.get(args.supplier, args.account)
+    jobs = args.job or ['inventory']
+    missing = [j for j in jobs if not hasattr(supplier, orchestrator.JOBS[j])]
+    if missing:
+        print(f"{supplier.name} has no {', '.join(missing)} job")
+        return 2
+    failed = 0
+    for job in jobs:
+        name, job, elapsed, error = orchestrator.run_job(supplier, job)
+        status = 'failed: %s' % error if error else 'ok'
+        print(f"{name} {job}: {status} ({elapsed:.1f}s)")
+        failed += error is not None
+    return 1 if failed else 0
+
+
+def merge_command(args) -> int:
+    sources = unified.supplier_sources(args.supplier)
+    count = unified.merge(sources, args.output, policy=args.policy, run_size=args.run_size)
+    print(f"Merged {count} SKUs into {args.output}")
+    return 0
+
+
+def metrics_command(args) -> int:
+    for line in metrics.report(args.last):
+        print(line)
+    return 0
+
+
+def daemon_command(args) -> int:
+    return daemon.run(args.jobs_file, scheduler=SCHEDULER)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='automation_tool', description='Supplier inventory automation')
+    commands = parser.add_subparsers(dest='command')
+    run_all = commands.add_parser('run-all', help='Refresh all suppliers concurrently and exit')
+    run_all.add_argument('--supplier', action='append', choices=registry.names(),
+                         help='Limit to this supplier (repeatable)')
+    run_all.add_argument('--jobs', default=','.join(orchestrator.JOBS),
+                         help='Comma separated jobs: %s' % ', '.join(orchestrator.JOBS))
+    run_all.add_argument('--workers', type=int, default=orchestrator.DEFAULT_WORKERS,
+                         help='Maximum concurrent jobs')
+    run_all.add_argument('--per-supplier', type=int, default=1,
+                         help='Maximum concurrent jobs per supplier')
+    run_all.add_argument('--accounts', action='store_true',
+                         help='Include every additional account configured for the suppliers')
+    # Former name of --accounts, from when it selected an asyncio runner.
+    run_all.add_argument('--async', dest='accounts', action='store_true', help=argparse.SUPPRESS)
+    run_all.set_defaults(func=run_all_command)
+    fetch = commands.add_parser('fetch', help='Run jobs of one supplier and exit')
+    fetch.add_argument('supplier', choices=registry.names(), help='Supplier to fetch')
+    fetch.add_argument('--job', action='append', choices=list(orchestrator.JOBS),
+                       help='Job to run (repeatable, default: inventory)')
+    fetch.add_argument('--account', help='Extra account configured for the supplier')
+    fetch.set_defaults(func=fetch_command)
+    run_daemon = commands.add_parser('daemon', help='Run the scheduled jobs without the menu')
+    run_daemon.add_argument('--jobs-file', default=daemon.JOBS_PATH,
+                            help='Job definitions (default: %(default)s)')
+    run_daemon.set_defaults(func=daemon_command)
+    merge = commands.add_parser('merge', help='Merge all full inventories into one feed')
+    merge.add_argument('--output', default='unified_inventory.csv', help='Merged feed path')
+    merge.add_argument('--policy', choices=unified.POLICIES, default='quantity',
+                       help='How to pick the source per SKU (default: %(default)s)')
+    merge.add_argument('--supplier', action='append', choices=registry.names(),
+                       help='Supplier to include, highest priority first (repeatable)')
+    merge.add_argument('--run-size', type=int, default=unified.RUN_SIZE,
+                       help='Rows sorted in memory at a time')
+    merge.set_defaults(func=merge_command)
+    show_metrics = commands.add_parser('metrics', help='Show timings of recent job runs')
+    show_metrics.add_argument('--last', type=int, default=20, help='Number of runs to show')
+    show_metrics.set_defaults(func=metrics_command)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.command:
+        sys.exit(args.func(args))
     while True:
         print("\nAutomation Tool")
         print("1. Keystone Automotive")
         print("2. CWR Distribution")
         print("3. Seawide")
-        print("4. Quit")
+        print("4. Job Metrics")
+        print("5. Quit")
         choice = input("Select supplier: ")
         if choice in SUPPLIERS:
             show_supplier_menu(choice)
         elif choice == '4':
-            for t in list(jobs.values()) + list(catalog_jobs.values()):
-                t.stop()
+            for line in metrics.report():
+                print(line)
+        elif choice == '5':
+            SCHEDULER.stop()
             break
         else:
             print("Invalid option")
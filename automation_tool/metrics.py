@@ -0,0 +1,345 @@
+"""Per-stage timing and throughput metrics for supplier jobs.
+
+A run is started by the outermost :func:`instrument`-decorated supplier
+method and collects, per stage, the time spent, rows produced and bytes
+transferred. Stages nest: the time of a stage excludes the stages it pulls
+from, so the figures for ``network``, ``parse``, ``delta`` and ``write`` add
+up to roughly the duration of the run. Finished runs are appended to
+``data/metrics.jsonl`` and summarised in ``data/metrics.prom`` for the
+Prometheus textfile collector.
+"""
+
+import functools
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from .base import DATA_DIR
+
+METRICS_PATH = os.path.join(DATA_DIR, 'metrics.jsonl')
+PROM_PATH = os.path.join(DATA_DIR, 'metrics.prom')
+# The jsonl file is rotated to ``.1`` past this size.
+MAX_BYTES = 5 * 1024 * 1024
+# Runs read back to build the Prometheus file.
+PROM_WINDOW = 1000
+
+_local = threading.local()
+_lock = threading.Lock()
+_handler = None
+
+
+class Run:
+    """Metrics of one supplier job."""
+    def __init__(self, supplier: str, job: str):
+        self.supplier = supplier
+        self.job = job
+        self.started = time.time()
+        self.seconds = 0.0
+        self.errors = 0
+        self.error = None
+        self.stages = {}
+        # Per thread: [stage, started, seconds spent in nested stages]
+        self._stacks = {}
+
+    def stage(self, name: str) -> dict:
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = {'seconds': 0.0, 'rows': 0, 'bytes': 0}
+        return stats
+
+    def enter(self, name: str) -> None:
+        stack = self._stacks.setdefault(threading.get_ident(), [])
+        stack.append([name, time.perf_counter(), 0.0])
+
+    def leave(self) -> None:
+        stack = self._stacks[threading.get_ident()]
+        name, started, nested = stack.pop()
+        elapsed = time.perf_counter() - started
+        self.stage(name)['seconds'] += elapsed - nested
+        if stack:
+            stack[-1][2] += elapsed
+
+    def as_dict(self) -> dict:
+        return {
+            'supplier': self.supplier,
+            'job': self.job,
+            'started': round(self.started, 3),
+            'seconds': round(self.seconds, 6),
+            'errors': self.errors,
+            'error': self.error,
+            'stages': {
+                name: dict(stats, seconds=round(stats['seconds'], 6))
+                for name, stats in self.stages.items()
+            },
+        }
+
+
+class _ErrorCounter(logging.Handler):
+    """Count errors logged while a run is active in the logging thread."""
+    def emit(self, record):
+        run = current()
+        if run is not None:
+            run.errors += 1
+
+
+def current():
+    """The run active in this thread, or ``None``."""
+    return getattr(_local, 'run', None)
+
+
+def instrument(job: str):
+    """Record a run for ``job`` around a supplier fetch method.
+
+    Calls nested inside another instrumented method, or made from a
+    thread started through :func:`propagate`, count towards the outer run.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if current() is not None:
+                return method(self, *args, **kwargs)
+            _install_handler()
+            run = _local.run = Run(self.name, job)
+            started = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            except BaseException as exc:
+                run.error = repr(exc)
+                raise
+            finally:
+                _local.run = None
+                run.seconds = time.perf_counter() - started
+                record(run)
+        return wrapper
+    return decorator
+
+
+def propagate(function):
+    """Wrap ``function`` to run under this thread's run in another thread.
+
+    Used for the racers of a hedged call, so both add to the run of the
+    ``fetch_inventory`` that started them. Their stages may overlap, and
+    then add up to more than the duration of the run.
+    """
+    run = current()
+    if run is None:
+        return function
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        previous, _local.run = current(), run
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _local.run = previous
+    return wrapper
+
+
+def _install_handler() -> None:
+    global _handler
+    with _lock:
+        if _handler is None:
+            _handler = _ErrorCounter(logging.ERROR)
+            logging.getLogger().addHandler(_handler)
+
+
+def stage(name: str, rows):
+    """Wrap the iterable ``rows``, timing each item under ``name``."""
+    run = current()
+    if run is None:
+        return rows
+    return _timed_rows(run, name, rows)
+
+
+def _timed_rows(run: Run, name: str, rows):
+    rows = iter(rows)
+    stats = run.stage(name)
+    while True:
+        run.enter(name)
+        try:
+            row = next(rows)
+        except StopIteration:
+            return
+        finally:
+            run.leave()
+        stats['rows'] += 1
+        yield row
+
+
+@contextmanager
+def timed(name: str):
+    """Time the ``with`` block under ``name``."""
+    run = current()
+    if run is None:
+        yield
+        return
+    run.enter(name)
+    try:
+        yield
+    finally:
+        run.leave()
+
+
+class _Reader:
+    """File wrapper timing ``read`` calls and counting the bytes returned."""
+    def __init__(self, run: Run, name: str, f):
+        self._run = run
+        self._name = name
+        self._stats = run.stage(name)
+        self._f = f
+
+    def read(self, size: int = -1) -> bytes:
+        self._run.enter(self._name)
+        try:
+            data = self._f.read(size)
+        finally:
+            self._run.leave()
+        self._stats['bytes'] += len(data)
+        return data
+
+    def __getattr__(self, attr):
+        return getattr(self._f, attr)
+
+
+def reader(name: str, f):
+    """Wrap the binary file ``f`` so reads count towards stage ``name``."""
+    run = current()
+    return f if run is None else _Reader(run, name, f)
+
+
+def add_bytes(name: str, count: int) -> None:
+    run = current()
+    if run is not None:
+        run.stage(name)['bytes'] += count
+
+
+def add_rows(name: str, count: int) -> None:
+    run = current()
+    if run is not None:
+        run.stage(name)['rows'] += count
+
+
+def record(run: Run) -> None:
+    """Append ``run`` to the metrics log and refresh the Prometheus file."""
+    try:
+        with _lock:
+            os.makedirs(DATA_DIR, exist_ok=True)
+            if os.path.exists(METRICS_PATH) and os.path.getsize(METRICS_PATH) > MAX_BYTES:
+                os.replace(METRICS_PATH, METRICS_PATH + '.1')
+            with open(METRICS_PATH, 'a') as f:
+                f.write(json.dumps(run.as_dict()) + '\n')
+            write_prometheus(load_runs(PROM_WINDOW))
+    except Exception as exc:
+        logging.warning('Could not record metrics for %s %s: %s', run.supplier, run.job, exc)
+
+
+def load_runs(limit: int = None) -> list:
+    """The last ``limit`` recorded runs, oldest first."""
+    if not os.path.exists(METRICS_PATH):
+        return []
+    with open(METRICS_PATH, 'r') as f:
+        lines = deque(f, maxlen=limit)
+    return [json.loads(line) for line in lines if line.strip()]
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile of ``values``."""
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[max(math.ceil(pct / 100 * len(values)) - 1, 0)]
+
+
+def summary(runs: list) -> dict:
+    """``{(supplier, job): {'runs', 'p50', 'p95'}}`` of run durations."""
+    durations = {}
+    for run in runs:
+        durations.setdefault((run['supplier'], run['job']), []).append(run['seconds'])
+    return {
+        key: {
+            'runs': len(values),
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+        }
+        for key, values in durations.items()
+    }
+
+
+def _labels(**labels) -> str:
+    return ','.join(
+        '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in labels.items()
+    )
+
+
+def write_prometheus(runs: list, path: str = PROM_PATH) -> None:
+    """Write the latest run and duration quantiles per job to ``path``."""
+    latest = {}
+    for run in runs:
+        latest[(run['supplier'], run['job'])] = run
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(f'{name}{{{labels}}} {value}' for labels, value in samples)
+
+    metric('automation_job_last_run_timestamp_seconds', 'gauge', 'Start of the last run.',
+           [(_labels(supplier=s, job=j), r['started']) for (s, j), r in latest.items()])
+    metric('automation_job_last_duration_seconds', 'gauge', 'Duration of the last run.',
+           [(_labels(supplier=s, job=j), r['seconds']) for (s, j), r in latest.items()])
+    metric('automation_job_last_errors', 'gauge', 'Errors logged during the last run.',
+           [(_labels(supplier=s, job=j), r['errors']) for (s, j), r in latest.items()])
+    quantiles = []
+    for (s, j), stats in summary(runs).items():
+        quantiles.append((_labels(supplier=s, job=j, quantile='0.5'), stats['p50']))
+        quantiles.append((_labels(supplier=s, job=j, quantile='0.95'), stats['p95']))
+    metric('automation_job_duration_seconds', 'summary', 'Duration of recent runs.', quantiles)
+    for field, unit in (('seconds', 'seconds'), ('rows', 'rows'), ('bytes', 'bytes')):
+        metric(f'automation_stage_last_{unit}', 'gauge', f'Stage {field} in the last run.',
+               [(_labels(supplier=s, job=j, stage=name), stats[field])
+                for (s, j), r in latest.items()
+                for name, stats in r['stages'].items()])
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp, path)
+
+
+def _size(count: int) -> str:
+    for unit in ('B', 'KB', 'MB'):
+        if count < 1024:
+            return f'{count:.0f}{unit}'
+        count /= 1024
+    return f'{count:.1f}GB'
+
+
+def report(limit: int = 20) -> list:
+    """Lines describing the last ``limit`` runs and p50/p95 per job."""
+    runs = load_runs(limit)
+    if not runs:
+        return ['No runs recorded']
+    lines = []
+    for run in runs:
+        started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(run['started']))
+        status = 'failed' if run['error'] else f"{run['errors']} errors" if run['errors'] else 'ok'
+        lines.append(f"{started} {run['supplier']} {run['job']} {run['seconds']:.1f}s {status}")
+        for name, stats in run['stages'].items():
+            detail = f"    {name:<10} {stats['seconds']:8.2f}s"
+            if stats['rows']:
+                detail += f" {stats['rows']} rows"
+            if stats['bytes']:
+                detail += f" {_size(stats['bytes'])}"
+            lines.append(detail)
+    lines.append('')
+    lines.append('Job duration over these runs:')
+    for (supplier, job), stats in sorted(summary(runs).items()):
+        lines.append(
+            f"  {supplier} {job}: {stats['runs']} runs, "
+            f"p50 {stats['p50']:.1f}s, p95 {stats['p95']:.1f}s"
+        )
+    return lines
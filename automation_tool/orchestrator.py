@@ -0,0 +1,86 @@
+"""Run supplier jobs concurrently in a bounded worker pool."""
+
+import logging
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from . import registry
+
+# Job name -> supplier method
+JOBS = {
+    'inventory': 'fetch_inventory',
+    'full': 'fetch_inventory_full',
+    'catalog': 'fetch_catalog',
+}
+
+DEFAULT_WORKERS = 8
+
+
+def run_job(supplier, job: str):
+    """Run one job, logging any failure; returns ``(supplier, job, seconds, error)``."""
+    start = time.monotonic()
+    logging.info('Starting %s %s', supplier.name, job)
+    try:
+        getattr(supplier, JOBS[job])()
+        error = None
+    except Exception as exc:
+        logging.exception('%s %s failed: %s', supplier.name, job, exc)
+        error = exc
+    elapsed = time.monotonic() - start
+    logging.info('Finished %s %s in %.1fs', supplier.name, job, elapsed)
+    return supplier.name, job, elapsed, error
+
+
+def suppliers_with_accounts(keys=None) -> list:
+    """Registered suppliers plus every additional account configured for them."""
+    suppliers = []
+    for key in keys or registry.names():
+        suppliers.append(registry.get(key))
+        suppliers.extend(registry.get(key, account) for account in registry.accounts(key))
+    return suppliers
+
+
+def run_all(suppliers=None, jobs=tuple(JOBS), max_workers: int = DEFAULT_WORKERS,
+            per_supplier: int = 1, accounts: bool = False) -> list:
+    """Run ``jobs`` for every registered supplier and return the results.
+
+    At most ``max_workers`` jobs run at once and at most ``per_supplier``
+    jobs of one supplier (overridable with its ``max_concurrency``
+    credential), so a full refresh takes about as long as the slowest
+    supplier. With ``accounts`` every additional account configured for
+    the suppliers is run as well, each with its own limit. Returns
+    ``(supplier, job, seconds, error)`` tuples.
+    """
+    if accounts:
+        instances = suppliers_with_accounts(suppliers)
+    else:
+        instances = [registry.get(key) for key in suppliers or registry.names()]
+    queues = {}
+    limits = {}
+    for supplier in instances:
+        pending = deque(j for j in jobs if hasattr(supplier, JOBS[j]))
+        if pending:
+            queues[supplier] = pending
+            limits[supplier] = int(supplier.get_credential('max_concurrency', per_supplier))
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fetch') as pool:
+        running = {}
+
+        def submit(supplier):
+            while queues[supplier] and running_count(supplier) < limits[supplier]:
+                job = queues[supplier].popleft()
+                running[pool.submit(run_job, supplier, job)] = supplier
+
+        def running_count(supplier):
+            return sum(1 for s in running.values() if s is supplier)
+
+        for supplier in queues:
+            submit(supplier)
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                supplier = running.pop(future)
+                results.append(future.result())
+                submit(supplier)
+    return results
@@ -0,0 +1,134 @@
+"""Crash-safe writes of output files with rotation and compression.
+
+Files are written to a temporary name in the same directory, flushed to disk
+and renamed over the target, so readers such as the uploader only ever see
+the previous or the new complete file. Two runs writing the same file use
+different temporary names; the last one to finish wins.
+
+``generations`` keeps that many previous versions as ``<file>.1`` (newest)
+to ``<file>.N``. ``compress`` (``gzip`` or ``zstd``) also writes a
+compressed copy next to the file, ``<file>.gz`` or ``<file>.zst``, and
+keeps the rotated generations compressed. ``zstd`` needs the optional
+``zstandard`` package.
+"""
+
+import gzip
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+
+COMPRESSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+def _compressed_open(compress: str):
+    if compress == 'gzip':
+        return gzip.open
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError('zstd compression needs the zstandard package') from None
+    return zstandard.open
+
+
+def check_compress(compress) -> None:
+    """Raise ``ValueError`` if ``compress`` cannot be used here."""
+    if compress is None:
+        return
+    if compress not in COMPRESSIONS:
+        raise ValueError(f'Unknown output compression: {compress}')
+    _compressed_open(compress)
+
+
+def generation_path(path: str, n: int, compress: str = None) -> str:
+    """Name of the ``n``-th previous version of ``path``."""
+    return f'{path}.{n}{COMPRESSIONS.get(compress, "")}'
+
+
+def _temp_path(path: str) -> str:
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, f'.{name}.{os.getpid()}.{threading.get_ident()}.tmp')
+
+
+def _fsync(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _compress_to(source: str, target: str, compress: str) -> None:
+    tmp = _temp_path(target)
+    try:
+        with open(source, 'rb') as src, _compressed_open(compress)(tmp, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        _fsync(tmp)
+        os.replace(tmp, target)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def rotate(path: str, generations: int, compress: str = None) -> None:
+    """Shift the previous versions of ``path`` and keep the current one as ``.1``."""
+    if generations <= 0 or not os.path.exists(path):
+        return
+    for n in range(generations - 1, 0, -1):
+        older = generation_path(path, n, compress)
+        if os.path.exists(older):
+            os.replace(older, generation_path(path, n + 1, compress))
+    newest = generation_path(path, 1, compress)
+    current = path + COMPRESSIONS[compress] if compress else None
+    if compress and os.path.exists(current):
+        os.replace(current, newest)
+    elif compress:
+        _compress_to(path, newest, compress)
+    else:
+        if os.path.exists(newest):
+            os.remove(newest)
+        try:
+            os.link(path, newest)
+        except OSError:
+            shutil.copy2(path, newest)
+
+
+def commit(tmp: str, path: str, generations: int = 0, compress: str = None) -> None:
+    """Flush the finished file ``tmp`` to disk and move it to ``path``."""
+    _fsync(tmp)
+    rotate(path, generations, compress)
+    os.replace(tmp, path)
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        _fsync(directory)
+    except OSError:
+        pass
+    if compress:
+        _compress_to(path, path + COMPRESSIONS[compress], compress)
+
+
+@contextmanager
+def atomic_open(path: str, mode: str = 'w', generations: int = 0, compress: str = None,
+                **kwargs):
+    """Open ``path`` for writing so it is only replaced once the block succeeds.
+
+    An exception inside the block leaves ``path`` and its generations as
+    they were.
+    """
+    check_compress(compress)
+    tmp = _temp_path(path)
+    try:
+        with open(tmp, mode.replace('w', 'x'), **kwargs) as f:
+            yield f
+        commit(tmp, path, generations, compress)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def copy_file(source: str, path: str, generations: int = 0, compress: str = None) -> None:
+    """Copy ``source`` to ``path`` through :func:`atomic_open`."""
+    with open(source, 'rb') as src, atomic_open(path, 'wb', generations, compress) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
@@ -0,0 +1,199 @@
+"""Parse large downloaded CSV and dataset XML files across processes.
+
+The file is split into byte ranges that end on record boundaries, each range
+is parsed in a worker process, and the rows are yielded in file order, with
+their SKUs mapped. Only a few chunks are in flight at a time, so memory
+stays bounded however large the file is. With one worker the file is
+streamed in this process instead.
+
+Workers are started with ``spawn`` so the pool is safe to use from the
+threaded scheduler.
+"""
+
+import csv
+import io
+import mmap
+import os
+import re
+import xml.etree.ElementTree as ET
+from collections import deque
+from .rows import record_type
+
+CHUNK_SIZE = 16 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+
+_NAMESPACE = re.compile(rb'xmlns:[\w.-]+="[^"]*"')
+
+
+def _read(path: str, start: int, end: int) -> bytes:
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start)
+
+
+def _parse_csv_chunk(path, start, end, fields, delimiter):
+    record = record_type(fields)
+    text = _read(path, start, end).decode('utf-8')
+    return [
+        (record.fields, record.from_strings(values).values())
+        for values in csv.reader(io.StringIO(text, newline=''), delimiter=delimiter)
+        if values
+    ]
+
+
+def _parse_dataset_chunk(path, start, end, head):
+    root = ET.fromstring(head + _read(path, start, end) + b'</NewDataSet>')
+    rows = []
+    for table in root:
+        if table.tag != 'Table':
+            continue
+        record = record_type(tuple(child.tag for child in table))
+        rows.append((record.fields, record.from_strings([c.text or '' for c in table]).values()))
+    return rows
+
+
+def csv_chunks(path: str, chunk_size: int = CHUNK_SIZE) -> tuple:
+    """``(header, ranges)``: the header line and byte ranges of whole records.
+
+    A newline only ends a record when an even number of quotes precede it,
+    so quoted fields containing line breaks are never split.
+    """
+    ranges = []
+    with open(path, 'rb') as f:
+        header = f.readline()
+        start = pos = f.tell()
+        target = start + chunk_size
+        odd = False
+        while True:
+            block = f.read(READ_SIZE)
+            if not block:
+                break
+            search = max(target - pos, 0)
+            while search < len(block):
+                i = block.find(b'\n', search)
+                if i < 0:
+                    break
+                if odd ^ (block.count(b'"', 0, i) & 1):
+                    search = i + 1
+                    continue
+                boundary = pos + i + 1
+                ranges.append((start, boundary))
+                start = boundary
+                target = boundary + chunk_size
+                search = target - pos
+            odd ^= block.count(b'"') & 1
+            pos += len(block)
+        if pos > start:
+            ranges.append((start, pos))
+    return header, ranges
+
+
+def _next_table(data, pos: int, end: int) -> int:
+    while True:
+        i = data.find(b'<Table', pos, end)
+        if i < 0 or data[i + 6:i + 7] in (b' ', b'>', b'/', b'\t', b'\r', b'\n'):
+            return i
+        pos = i + 6
+
+
+def dataset_chunks(path: str, chunk_size: int = CHUNK_SIZE):
+    """``(head, ranges)`` splitting a dataset's ``Table`` rows, or ``None``.
+
+    ``head`` is a ``NewDataSet`` start tag declaring the document's namespace
+    prefixes so each range parses on its own. ``None`` means the file has no
+    dataset this splitter understands. The file is memory-mapped and only
+    searched for boundaries, so it is never read into memory whole.
+    """
+    if not os.path.getsize(path):
+        return None
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return _dataset_chunks(data, chunk_size)
+
+
+def _dataset_chunks(data, chunk_size: int):
+    open_tag = data.find(b'<NewDataSet')
+    if open_tag < 0:
+        return None
+    body = data.find(b'>', open_tag) + 1
+    if data[body - 2:body] == b'/>':
+        return b'', []
+    end = data.rfind(b'</NewDataSet>')
+    if end < body:
+        return None
+    tag = data[open_tag:body - 1]
+    declared = set(_NAMESPACE.findall(tag))
+    inherited = [ns for ns in dict.fromkeys(_NAMESPACE.findall(data, 0, open_tag)) if ns not in declared]
+    head = b' '.join([tag] + inherited) + b'>'
+    ranges = []
+    start = _next_table(data, body, end)
+    while 0 <= start < end:
+        nxt = _next_table(data, min(start + chunk_size, end), end)
+        stop = end if nxt < 0 else nxt
+        ranges.append((start, stop))
+        start = nxt
+    return head, ranges
+
+
+def _results(tasks, workers: int):
+    """Run ``(function, args)`` tasks and yield their rows in task order."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        pending = deque()
+        for function, args in tasks:
+            pending.append(pool.submit(function, *args))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def _records(rows):
+    for fields, values in rows:
+        yield record_type(fields)(values)
+
+
+def iter_csv(path: str, workers: int = 1, delimiter: str = ',', sku_field: str = 'SKU',
+             mapping_file: str = None, chunk_size: int = CHUNK_SIZE):
+    """Yield the records of a CSV file with a header row, in file order.
+
+    ``mapping_file`` rewrites ``sku_field`` for SKUs it lists, see
+    ``inventory_processor.map_rows``.
+    """
+    from inventory_processor import map_rows
+    yield from map_rows(_iter_csv(path, workers, delimiter, chunk_size), mapping_file, sku_field)
+
+
+def _iter_csv(path, workers, delimiter, chunk_size):
+    if workers <= 1:
+        with open(path, newline='', encoding='utf-8') as f:
+            reader = csv.reader(f, delimiter=delimiter)
+            record = record_type(next(reader, []))
+            yield from (record.from_strings(values) for values in reader if values)
+        return
+    header, ranges = csv_chunks(path, chunk_size)
+    fields = tuple(next(csv.reader([header.decode('utf-8')], delimiter=delimiter), []))
+    tasks = [
+        (_parse_csv_chunk, (path, start, end, fields, delimiter))
+        for start, end in ranges
+    ]
+    yield from _records(_results(tasks, workers))
+
+
+def iter_dataset(path: str, workers: int = 1, sku_field: str = None,
+                 mapping_file: str = None, chunk_size: int = CHUNK_SIZE):
+    """Yield the ``Table`` rows of a saved SOAP dataset XML file in order."""
+    from inventory_processor import map_rows
+    yield from map_rows(_iter_dataset_file(path, workers, chunk_size), mapping_file, sku_field)
+
+
+def _iter_dataset_file(path, workers, chunk_size):
+    from .keystone import _iter_dataset
+    chunks = dataset_chunks(path, chunk_size) if workers > 1 else None
+    if chunks is None:
+        yield from _iter_dataset(path)
+        return
+    head, ranges = chunks
+    tasks = [(_parse_dataset_chunk, (path, start, end, head)) for start, end in ranges]
+    yield from _records(_results(tasks, workers))
@@ -0,0 +1,56 @@
+"""Registry of supplier implementations, constructed on first use."""
+
+import importlib
+import os
+import threading
+from .base import ACCOUNTS_DIR
+
+# Registry key -> (module, class name)
+SUPPLIERS = {
+    'keystone': ('.keystone', 'KeystoneSupplier'),
+    'cwr': ('.cwr', 'CwrSupplier'),
+    'seawide': ('.seawide', 'SeawideSupplier'),
+}
+
+_instances = {}
+_lock = threading.Lock()
+
+
+def register(key: str, module: str, class_name: str) -> None:
+    """Register a supplier class by module path without importing it."""
+    SUPPLIERS[key] = (module, class_name)
+
+
+def names() -> list:
+    return list(SUPPLIERS)
+
+
+def get(key: str, account: str = None):
+    """Return the shared supplier instance for ``key`` and ``account``."""
+    with _lock:
+        supplier = _instances.get((key, account))
+        if supplier is None:
+            module, class_name = SUPPLIERS[key]
+            cls = getattr(importlib.import_module(module, __package__), class_name)
+            supplier = _instances[(key, account)] = cls(account) if account else cls()
+        return supplier
+
+
+def accounts(key: str) -> list:
+    """Additional account names configured under ``data/accounts/<key>``."""
+    path = os.path.join(ACCOUNTS_DIR, key)
+    if not os.path.isdir(path):
+        return []
+    return sorted(
+        os.path.splitext(f)[0] for f in os.listdir(path) if f.endswith('.json')
+    )
+
+
+def reload() -> None:
+    """Construct suppliers afresh, with current credentials, on next use.
+
+    Jobs already running keep the instance they hold, so their credentials
+    do not change underneath them.
+    """
+    with _lock:
+        _instances.clear()
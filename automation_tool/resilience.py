@@ -0,0 +1,249 @@
+"""Timeouts, retries, circuit breakers and hedged fallbacks for supplier calls.
+
+* :func:`retry` repeats a call that failed on a transient network error,
+  sleeping a random ("full jitter") share of an exponentially growing delay.
+* :class:`Circuit` counts consecutive failures of one endpoint. After
+  ``threshold`` of them it opens and calls fail fast with
+  :class:`CircuitOpen` for ``reset_after`` seconds, so a supplier goes
+  straight to its fallback instead of waiting on a dead endpoint. The next
+  call after that is a trial that closes the circuit again on success.
+  Circuit state is kept in the ``circuits`` state store so one-shot runs
+  share it.
+* :func:`hedge` starts the fallback when the primary has not succeeded
+  within a latency budget and keeps whichever finishes first. The racers
+  hold a :class:`Ticket` each: the first to :meth:`~Ticket.claim` wins and
+  the other is cancelled at its next :meth:`~Ticket.check`.
+"""
+
+import http.client
+import logging
+import random
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from .state import open_store
+
+# Seconds a single network operation may block.
+DEFAULT_TIMEOUT = 60
+RETRIES = 3
+BACKOFF = 1.0
+MAX_BACKOFF = 30.0
+FAILURE_THRESHOLD = 3
+RESET_AFTER = 5 * 60
+
+_circuits = {}
+_lock = threading.Lock()
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an endpoint whose circuit is open."""
+
+
+class Cancelled(Exception):
+    """Raised in a hedged racer after the other racer has won."""
+
+
+def transient(exc: BaseException) -> bool:
+    """True for errors worth retrying: network failures and 5xx answers."""
+    status = getattr(exc, 'status', None)
+    if isinstance(status, int):
+        return status >= 500
+    return isinstance(exc, (OSError, socket.timeout, http.client.HTTPException))
+
+
+def backoff(attempt: int, base: float = BACKOFF, cap: float = MAX_BACKOFF) -> float:
+    """Jittered delay before retry number ``attempt`` (starting at 1)."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def retry(function, attempts: int = RETRIES, base: float = BACKOFF, cap: float = MAX_BACKOFF,
+          sleep=time.sleep):
+    """Call ``function()`` up to ``attempts`` times while it fails transiently."""
+    attempt = 1
+    while True:
+        try:
+            return function()
+        except Exception as exc:
+            if attempt >= attempts or not transient(exc):
+                raise
+            delay = backoff(attempt, base, cap)
+            logging.warning('Attempt %d failed (%r), retrying in %.1fs', attempt, exc, delay)
+            sleep(delay)
+            attempt += 1
+
+
+class Circuit:
+    """Failure counter for one endpoint that fails fast while it is down."""
+    def __init__(self, name: str, threshold: int = FAILURE_THRESHOLD,
+                 reset_after: float = RESET_AFTER):
+        self.name = name
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self._store = open_store('circuits')
+        self._lock = threading.Lock()
+        self._trial = False
+
+    def _state(self) -> dict:
+        return self._store.get(self.name) or {'failures': 0, 'opened': None}
+
+    def is_open(self, now: float = None) -> bool:
+        opened = self._state()['opened']
+        return opened is not None and (now or time.time()) - opened < self.reset_after
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead; only one trial runs once a circuit half-opens."""
+        with self._lock:
+            state = self._state()
+            if state['opened'] is None:
+                return True
+            if self.is_open() or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def success(self) -> None:
+        with self._lock:
+            self._trial = False
+            if self._state() != {'failures': 0, 'opened': None}:
+                logging.info('Circuit %s closed', self.name)
+                self._store.delete(self.name)
+
+    def failure(self) -> None:
+        with self._lock:
+            self._trial = False
+            state = self._state()
+            failures = state['failures'] + 1
+            opened = state['opened']
+            if failures >= self.threshold:
+                if opened is None or not self.is_open():
+                    logging.warning('Circuit %s opened after %d failures', self.name, failures)
+                opened = time.time()
+            self._store.set(self.name, {'failures': failures, 'opened': opened})
+
+    def call(self, function, *args, **kwargs):
+        """Call ``function`` through the circuit, raising :class:`CircuitOpen` if it is open.
+
+        Only transient errors count as failures; a :class:`Cancelled` hedge
+        racer counts as neither.
+        """
+        if not self.allow():
+            raise CircuitOpen(self.name)
+        try:
+            result = function(*args, **kwargs)
+        except Cancelled:
+            with self._lock:
+                self._trial = False
+            raise
+        except Exception as exc:
+            if transient(exc):
+                self.failure()
+            else:
+                self.success()
+            raise
+        self.success()
+        return result
+
+
+def circuit(name: str, **options) -> Circuit:
+    """The shared :class:`Circuit` for endpoint ``name``."""
+    with _lock:
+        breaker = _circuits.get(name)
+        if breaker is None:
+            breaker = _circuits[name] = Circuit(name, **options)
+        return breaker
+
+
+class Token:
+    """Shared by the racers of one hedged call; the first claim wins."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.winner = None
+
+    def ticket(self, name: str) -> 'Ticket':
+        return Ticket(self, name)
+
+
+class Ticket:
+    """One racer's handle on a :class:`Token`."""
+    def __init__(self, token: Token, name: str):
+        self.token = token
+        self.name = name
+
+    def claim(self) -> bool:
+        """Claim the win; ``False`` if the other racer already has."""
+        with self.token._lock:
+            if self.token.winner is None:
+                self.token.winner = self.name
+            return self.token.winner == self.name
+
+    def win(self) -> None:
+        """Claim the win or raise :class:`Cancelled`."""
+        if not self.claim():
+            raise Cancelled(self.name)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.token.winner not in (None, self.name)
+
+    def check(self) -> None:
+        """Raise :class:`Cancelled` if the other racer has won."""
+        if self.cancelled:
+            raise Cancelled(self.name)
+
+    def guard(self, rows):
+        """Pass ``rows`` through, stopping once the other racer wins.
+
+        The win is claimed when ``rows`` is exhausted, before downstream
+        writers commit anything. An empty result claims nothing so the other
+        racer can still deliver.
+        """
+        count = 0
+        for row in rows:
+            self.check()
+            count += 1
+            yield row
+        if count:
+            self.win()
+
+
+def hedge(primary, fallback, budget: float, name: str = 'hedge') -> bool:
+    """Run ``primary(ticket)`` and race ``fallback(ticket)`` against it.
+
+    ``fallback`` starts when ``primary`` has not returned a true value
+    within ``budget`` seconds or has failed. Returns whether either
+    succeeded. The losing racer is left to notice its cancelled ticket,
+    which it checks for every row or downloaded block and then stops with
+    :class:`Cancelled`; this call does not wait for it. Both racers run
+    under the caller's metrics run.
+    """
+    from . import metrics
+    primary, fallback = metrics.propagate(primary), metrics.propagate(fallback)
+    token = Token()
+    pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix=name)
+    try:
+        first = pool.submit(primary, token.ticket('primary'))
+        done, _ = wait([first], timeout=budget)
+        if done and _succeeded(first):
+            return True
+        logging.info('%s: primary %s, starting fallback', name, 'failed' if done else 'slow')
+        pending = {pool.submit(fallback, token.ticket('fallback'))}
+        if not done:
+            pending.add(first)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            if any(_succeeded(f) for f in done):
+                return True
+        return False
+    finally:
+        pool.shutdown(wait=False)
+
+
+def _succeeded(future) -> bool:
+    try:
+        return bool(future.result())
+    except Cancelled:
+        return False
+    except Exception as exc:
+        logging.exception('Hedged call failed: %s', exc)
+        return False
@@ -0,0 +1,208 @@
+"""Compact row types for parsed inventory and catalog data.
+
+Feeds repeat the same handful of columns for every SKU, so instead of a dict
+per row a :class:`Record` keeps only a tuple of values and shares the field
+names with every row of its schema. Quantity and price columns are converted
+to ``int`` and ``Decimal`` when that round-trips to the original text, so
+writing a record back out produces the same file. Records are read-only
+mappings; ``copy()`` returns a plain dict for callers that need to edit one.
+
+:class:`RowTable` holds a whole dataset column by column for the paths that
+keep every row in memory, such as ``catalog.load_rows``.
+"""
+
+import threading
+from array import array
+from collections.abc import Mapping, Sequence
+from decimal import Decimal, InvalidOperation
+
+QUANTITY_FIELDS = frozenset({'Quantity', 'TotalQty', 'qtynj', 'qtyfl'})
+PRICE_FIELDS = frozenset({'Price', 'Cost', 'MAP', 'MRP'})
+
+_types = {}
+_types_lock = threading.Lock()
+
+
+def to_int(value):
+    """``value`` as an ``int`` if it is a string that round-trips exactly."""
+    if value.__class__ is not str:
+        return value
+    try:
+        number = int(value)
+    except ValueError:
+        return value
+    return number if str(number) == value else value
+
+
+def to_decimal(value):
+    """``value`` as a ``Decimal`` if it is a string that round-trips exactly."""
+    if value.__class__ is not str or not value:
+        return value
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        return value
+    return number if str(number) == value else value
+
+
+def converter(field: str):
+    """Numeric conversion applied to ``field``, or ``None`` to keep text."""
+    if field in QUANTITY_FIELDS or field.endswith('Qty'):
+        return to_int
+    if field in PRICE_FIELDS:
+        return to_decimal
+    return None
+
+
+class Record(Mapping):
+    """Read-only mapping over a tuple of values in ``fields`` order."""
+    __slots__ = ('_values',)
+    fields = ()
+    _index = {}
+    _numeric = ()
+
+    def __init__(self, values: tuple):
+        self._values = values
+
+    @classmethod
+    def from_strings(cls, values):
+        """Build a record from raw column text, converting numeric columns.
+
+        Missing trailing values become ``None`` and extra ones are dropped.
+        """
+        values = list(values)
+        if len(values) != len(cls.fields):
+            values = (values + [None] * len(cls.fields))[:len(cls.fields)]
+        for i, convert in cls._numeric:
+            values[i] = convert(values[i])
+        return cls(tuple(values))
+
+    def __getitem__(self, key):
+        try:
+            return self._values[self._index[key]]
+        except KeyError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        i = self._index.get(key)
+        return default if i is None else self._values[i]
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def values(self):
+        return self._values
+
+    def copy(self) -> dict:
+        return dict(zip(self.fields, self._values))
+
+    def replace(self, field: str, value) -> 'Record':
+        """A record of the same schema with ``field`` set to ``value``."""
+        i = self._index[field]
+        return type(self)(self._values[:i] + (value,) + self._values[i + 1:])
+
+    def __reduce__(self):
+        return _rebuild, (self.fields, self._values)
+
+    def __repr__(self):
+        return f'Record({self.copy()!r})'
+
+
+def _rebuild(fields: tuple, values: tuple) -> Record:
+    return record_type(fields)(values)
+
+
+def record_type(fields) -> type:
+    """The shared :class:`Record` subclass for rows with ``fields``."""
+    fields = tuple(fields)
+    cls = _types.get(fields)
+    if cls is None:
+        with _types_lock:
+            cls = _types.get(fields)
+            if cls is None:
+                numeric = tuple(
+                    (i, converter(f)) for i, f in enumerate(fields) if converter(f)
+                )
+                cls = _types[fields] = type('Record', (Record,), {
+                    '__slots__': (),
+                    'fields': fields,
+                    '_index': {f: i for i, f in enumerate(fields)},
+                    '_numeric': numeric,
+                })
+    return cls
+
+
+def _pack(column: list):
+    """Store an all-integer column as a 64-bit array."""
+    if column and all(v.__class__ is int and -2 ** 63 <= v < 2 ** 63 for v in column):
+        return array('q', column)
+    return column
+
+
+class RowTable(Sequence):
+    """Rows stored column by column, read back as :class:`Record` views."""
+    def __init__(self, fields=(), columns=None):
+        self.fields = tuple(fields)
+        self._columns = columns if columns is not None else [[] for _ in self.fields]
+        self._type = record_type(self.fields)
+
+    @classmethod
+    def from_rows(cls, rows) -> 'RowTable':
+        """Collect ``rows`` (records or mappings) into columns.
+
+        Fields are taken in first-seen order; a row lacking a field gets an
+        empty string for it.
+        """
+        fields = []
+        index = {}
+        columns = []
+        count = 0
+        last_fields = None
+        for row in rows:
+            row_fields = row.fields if isinstance(row, Record) else tuple(row)
+            if row_fields != last_fields:
+                for field in row_fields:
+                    if field not in index:
+                        index[field] = len(fields)
+                        fields.append(field)
+                        columns.append([''] * count)
+                positions = [index[f] for f in row_fields]
+                aligned = positions == list(range(len(fields)))
+                last_fields = row_fields
+            values = row.values() if isinstance(row, Record) else [row[f] for f in row_fields]
+            if aligned:
+                for column, value in zip(columns, values):
+                    column.append(value)
+            else:
+                for column in columns:
+                    column.append('')
+                for i, value in zip(positions, values):
+                    columns[i][count] = value
+            count += 1
+        return cls(fields, [_pack(c) for c in columns])
+
+    def column(self, field: str):
+        """All values of ``field`` as a list or integer ``array``."""
+        return self._columns[self.fields.index(field)]
+
+    def __len__(self):
+        return len(self._columns[0]) if self._columns else 0
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return RowTable(self.fields, [c[i] for c in self._columns])
+        return self._type(tuple(c[i] for c in self._columns))
+
+    def __iter__(self):
+        cls = self._type
+        for values in zip(*self._columns):
+            yield cls(values)
+
+    def __repr__(self):
+        return f'RowTable({len(self)} rows, fields={list(self.fields)!r})'
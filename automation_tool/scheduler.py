@@ -1,36 +1,194 @@
+import heapq
+import itertools
+import logging
+import random
 import threading
 import time
-import logging
+from concurrent.futures import ThreadPoolExecutor
+from .state import open_store
+
+# Worker threads running due jobs.
+DEFAULT_WORKERS = 4
+# Upper bound on the random delay added to each run.
+MAX_JITTER = 60
+# Runs missed while the process was down are spread over this many seconds.
+CATCH_UP_WINDOW = 5 * 60
+
+
+class Job:
+    """A function run every ``interval`` seconds."""
+    def __init__(self, name: str, function, interval: float, jitter: float, persist: bool = True):
+        self.name = name
+        self.persist = persist
+        self.function = function
+        self.interval = interval
+        self.jitter = jitter
+        # ``slot`` is the unjittered schedule; ``next_run`` adds the jitter.
+        self.slot = None
+        self.next_run = None
+
+
+class Scheduler:
+    """Run jobs from a time-ordered heap on a bounded worker pool.
+
+    A single dispatcher thread sleeps until the earliest job is due and
+    hands it to the pool. A job that is still running when it comes due
+    again is skipped rather than started twice. Runs are offset by random
+    jitter so jobs with the same interval do not fire together, and next
+    run times are persisted so a restart resumes the schedule instead of
+    starting every interval over.
+    """
+    def __init__(self, max_workers: int = DEFAULT_WORKERS, state_name: str = 'schedule'):
+        self._jobs = {}
+        # Names of jobs with a run in progress; a replaced job keeps its
+        # name, so a run of the old definition still blocks the new one.
+        self._running = set()
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._max_workers = max_workers
+        self._executor = None
+        self._thread = None
+        self._stopped = False
+        self._store = open_store(state_name)
+
+    def add_job(self, name: str, function, interval: float, jitter: float = None,
+                persist: bool = True) -> Job:
+        """Schedule ``function`` every ``interval`` seconds, replacing ``name``.
+
+        With ``persist`` the next run time survives restarts under ``name``.
+        """
+        if jitter is None:
+            jitter = min(interval * 0.1, MAX_JITTER)
+        job = Job(name, function, interval, jitter, persist)
+        now = time.time()
+        saved = self._store.get(name) if persist else None
+        if saved is None:
+            job.slot = now + interval
+            job.next_run = job.slot + random.uniform(0, jitter)
+        elif saved < now:
+            # Missed while stopped: catch up soon, but not all at once.
+            job.slot = job.next_run = now + random.uniform(0, min(interval, CATCH_UP_WINDOW))
+        else:
+            job.slot = job.next_run = min(saved, now + interval + jitter)
+        with self._cond:
+            self._jobs[name] = job
+            self._push(job)
+        self._save(job)
+        logging.info("Scheduled %s every %s seconds", name, interval)
+        return job
+
+    def remove_job(self, name: str) -> None:
+        """Unschedule ``name``; a run already in progress is left to finish."""
+        with self._cond:
+            job = self._jobs.pop(name, None)
+            self._cond.notify()
+        if job is not None:
+            self._store.delete(name)
+            logging.info("Stopped schedule for %s", name)
+
+    def jobs(self) -> dict:
+        with self._cond:
+            return dict(self._jobs)
+
+    def start(self) -> None:
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._executor = ThreadPoolExecutor(self._max_workers, thread_name_prefix='job')
+            self._thread = threading.Thread(target=self._dispatch, name='scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self, wait: bool = False) -> None:
+        """Stop dispatching; ``wait`` blocks until running jobs finish."""
+        with self._cond:
+            self._stopped = True
+            thread, self._thread = self._thread, None
+            executor, self._executor = self._executor, None
+            self._cond.notify()
+        if thread is not None:
+            thread.join()
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def _push(self, job: Job) -> None:
+        heapq.heappush(self._heap, (job.next_run, next(self._seq), job))
+        self._cond.notify()
+
+    def _dispatch(self) -> None:
+        with self._cond:
+            while not self._stopped:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due, _, job = self._heap[0]
+                if self._jobs.get(job.name) is not job or job.next_run != due:
+                    heapq.heappop(self._heap)
+                    continue
+                delay = due - time.time()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                if job.name in self._running:
+                    logging.warning("Skipping %s, previous run still in progress", job.name)
+                else:
+                    self._running.add(job.name)
+                    self._executor.submit(self._run, job)
+                self._reschedule(job)
+
+    def _reschedule(self, job: Job) -> None:
+        # Advance the unjittered slot so jitter never accumulates as drift;
+        # slots missed while the pool was busy are skipped, not replayed.
+        now = time.time()
+        job.slot += job.interval
+        if job.slot <= now:
+            job.slot = now + job.interval
+        job.next_run = job.slot + random.uniform(0, job.jitter)
+        self._push(job)
+        self._save(job)
+
+    def _save(self, job: Job) -> None:
+        if job.persist:
+            self._store.set(job.name, job.next_run)
+
+    def _run(self, job: Job) -> None:
+        logging.info("Running scheduled task %s", job.name)
+        try:
+            job.function()
+        except Exception as exc:
+            logging.exception("Scheduled task failed: %s", exc)
+        finally:
+            with self._cond:
+                self._running.discard(job.name)
+
+
+SCHEDULER = Scheduler()
+
 
 class RepeatedTimer:
-    """Run a function at a specified interval in seconds."""
+    """Run a function at a specified interval in seconds.
+
+    Kept for compatibility; jobs run on the shared :data:`SCHEDULER`.
+    """
     def __init__(self, interval, function, *args, **kwargs):
         self.interval = interval
         self.function = function
         self.args = args
         self.kwargs = kwargs
-        self._timer = None
+        self.name = f'{getattr(function, "__qualname__", function)}@{id(self)}'
         self.is_running = False
 
-    def _run(self):
-        self.is_running = False
-        self.start()
-        logging.info("Running scheduled task %s", self.function.__name__)
-        try:
-            self.function(*self.args, **self.kwargs)
-        except Exception as exc:
-            logging.exception("Scheduled task failed: %s", exc)
+    def _call(self):
+        self.function(*self.args, **self.kwargs)
 
     def start(self):
         if not self.is_running:
-            logging.info("Starting timer for %s every %s seconds", self.function.__name__, self.interval)
-            self._timer = threading.Timer(self.interval, self._run)
-            self._timer.daemon = True
-            self._timer.start()
+            SCHEDULER.add_job(self.name, self._call, self.interval, persist=False)
+            SCHEDULER.start()
             self.is_running = True
 
     def stop(self):
-        if self._timer:
-            self._timer.cancel()
-        logging.info("Stopped timer for %s", self.function.__name__)
+        SCHEDULER.remove_job(self.name)
         self.is_running = False
@@ -1,59 +1,75 @@
 import logging
-import ftplib
 import os
-import csv
-import urllib.request
-import xml.etree.ElementTree as ET
 from .base import Supplier
-from . import catalog
-from .keystone import _parse_dataset
+from . import catalog, metrics, parallel, resilience, soap
+from .keystone import _iter_dataset, _write_rows
+
+SEAWIDE = soap.Service('https://api.seawide.com/inventory.asmx', 'http://seawide.com', 'sea')
 
 class SeawideSupplier(Supplier):
     """Seawide supplier implementation."""
-    def __init__(self):
-        super().__init__('Seawide', 'seawide.json')
+    full_output = 'seawide_inventory_full.csv'
+
+    def __init__(self, account: str = None):
+        super().__init__('Seawide', 'seawide.json', account)
+
+    def _ftp_credentials(self):
+        """FTP login as keyword arguments for the session pool, or ``None``."""
+        host = self.get_credential('host')
+        user = self.get_credential('username')
+        password = self.get_credential('password')
+        if not host or not user or not password:
+            return None
+        return {
+            'host': host,
+            'user': user,
+            'password': password,
+            'port': int(self.get_credential('port', 21)),
+            'protocol': self.get_credential('protocol', 'ftps').lower(),
+            'timeout': self.timeout(),
+        }
 
     # Primary method: SOAP API inventory tracking
-    def fetch_inventory_primary(self) -> bool:
+    def fetch_inventory_primary(self, ticket=None) -> bool:
         account = self.get_credential('account_number')
         key = self.get_credential('api_key')
         if not account or not key:
             logging.warning('Seawide API credentials missing')
-            return
-        return self._fetch_inventory_update_soap(account, key)
+            return False
+        return self._fetch_inventory_update_soap(account, key, ticket)
 
     # Backwards compatible alias
+    @metrics.instrument('inventory')
     def fetch_inventory(self) -> None:
-        if not self.fetch_inventory_primary():
-            logging.info('Falling back to Seawide FTP inventory update')
-            self.fetch_inventory_secondary()
+        self.failover(self.fetch_inventory_primary, self.fetch_inventory_secondary)
 
     # Secondary method: FTP download
-    def fetch_inventory_secondary(self) -> None:
-        host = self.get_credential('host')
-        user = self.get_credential('username')
-        password = self.get_credential('password')
-        port = int(self.get_credential('port', 21))
-        protocol = self.get_credential('protocol', 'ftps').lower()
+    def fetch_inventory_secondary(self, ticket=None) -> bool:
+        credentials = self._ftp_credentials()
         remote_file = self.get_credential('remote_update_file', 'inventory_update.csv')
         output = self.get_credential('output', 'seawide_inventory_update.csv')
 
-        if not host or not user or not password:
+        if not credentials:
             logging.warning('Seawide FTP credentials missing')
-            return
+            return False
 
         try:
-            with (ftplib.FTP() if protocol == 'ftp' else ftplib.FTP_TLS()) as ftp:
-                ftp.connect(host, port)
-                ftp.login(user, password)
-                if protocol != 'ftp':
-                    ftp.prot_p()
-                with open(output, 'wb') as f:
-                    ftp.retrbinary(f'RETR {remote_file}', f.write)
+            from .ftpsession import POOL
+            # SOAP writes the same file, so a hedged download only replaces
+            # it once it has won the race.
+            if ticket is not None:
+                ticket.check()
+            POOL.download(remote_file, output, ticket=ticket, **self.output_options(),
+                          **credentials)
             logging.info('Downloaded Seawide inventory update to %s', output)
+            return True
+        except resilience.Cancelled:
+            logging.info('Seawide FTP update superseded by SOAP')
         except Exception as exc:
             logging.exception('Failed to fetch Seawide inventory: %s', exc)
+        return False
 
+    @metrics.instrument('full')
     def fetch_inventory_full(self) -> None:
         """Download the full inventory file via SOAP or FTP."""
         account = self.get_credential('account_number')
@@ -62,92 +78,67 @@ class SeawideSupplier(Supplier):
             self._fetch_inventory_full_soap(account, key)
             return
 
-        host = self.get_credential('host')
-        user = self.get_credential('username')
-        password = self.get_credential('password')
-        port = int(self.get_credential('port', 21))
-        protocol = self.get_credential('protocol', 'ftps').lower()
+        credentials = self._ftp_credentials()
         remote_file = self.get_credential('remote_full_file', 'inventory_full.csv')
-        output = self.get_credential('full_output', 'seawide_inventory_full.csv')
+        output = self.get_credential('full_output', self.full_output)
 
-        if not host or not user or not password:
+        if not credentials:
             logging.warning('Seawide FTP credentials missing')
             return
 
         try:
-            with (ftplib.FTP() if protocol == 'ftp' else ftplib.FTP_TLS()) as ftp:
-                ftp.connect(host, port)
-                ftp.login(user, password)
-                if protocol != 'ftp':
-                    ftp.prot_p()
-                with open(output, 'wb') as f:
-                    ftp.retrbinary(f'RETR {remote_file}', f.write)
-            logging.info('Downloaded Seawide full inventory to %s', output)
+            with self.conditional_ftp('inventory_full', remote_file, output, credentials) as changed:
+                if not changed:
+                    logging.info('Seawide full inventory unchanged, skipping')
+                    return
+                logging.info('Downloaded Seawide full inventory to %s', output)
+                rows = metrics.stage('parse', parallel.iter_csv(output, self.parse_workers()))
+                with self.track_delta(rows, output) as rows:
+                    for _ in rows:
+                        pass
         except Exception as exc:
             logging.exception('Failed to fetch Seawide full inventory: %s', exc)
 
-    def _fetch_inventory_update_soap(self, account: str, key: str) -> bool:
+    def _fetch_inventory_update_soap(self, account: str, key: str, ticket=None) -> bool:
         """Retrieve inventory updates via SOAP."""
         output = self.get_credential('output', 'seawide_inventory_update.csv')
-        envelope = f'''<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:sea="http://seawide.com">
-  <soapenv:Header/>
-  <soapenv:Body>
-    <sea:GetInventoryUpdates>
-      <sea:Key>{key}</sea:Key>
-      <sea:FullAccountNo>{account}</sea:FullAccountNo>
-    </sea:GetInventoryUpdates>
-  </soapenv:Body>
-</soapenv:Envelope>'''
-        req = urllib.request.Request(
-            'https://api.seawide.com/inventory.asmx',
-            data=envelope.encode('utf-8'),
-            headers={'Content-Type': 'text/xml; charset=utf-8',
-                    'SOAPAction': 'http://seawide.com/GetInventoryUpdates'},
-        )
+
+        def pull():
+            with SEAWIDE.call('GetInventoryUpdates', key, account, timeout=self.timeout()) as resp:
+                rows = metrics.stage('parse', _iter_dataset(resp))
+                if ticket is not None:
+                    rows = ticket.guard(rows)
+                with self.track_delta(self.aggregate(rows), output, full=False) as rows:
+                    return _write_rows(rows, output, **self.output_options())
+
         try:
-            with urllib.request.urlopen(req) as resp:
-                xml_data = resp.read()
-            rows = _parse_dataset(xml_data)
-            if rows:
-                with open(output, 'w', newline='') as f:
-                    writer = csv.DictWriter(f, fieldnames=rows[0].keys())
-                    writer.writeheader()
-                    writer.writerows(rows)
-                logging.info('Saved Seawide inventory update to %s', output)
+            count = self.call_endpoint(SEAWIDE.url, pull)
+            if count:
+                logging.info('Saved %d Seawide inventory update rows to %s', count, output)
                 return True
             logging.warning('No data returned from Seawide update')
+        except resilience.CircuitOpen:
+            logging.warning('Seawide SOAP endpoint is failing, skipping it')
+        except resilience.Cancelled:
+            logging.info('Seawide SOAP update superseded by FTP')
         except Exception as exc:
             logging.exception('Failed to fetch Seawide SOAP update: %s', exc)
         return False
 
     def _fetch_inventory_full_soap(self, account: str, key: str) -> None:
         """Retrieve full inventory via SOAP."""
-        output = self.get_credential('full_output', 'seawide_inventory_full.csv')
-        envelope = f'''<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:sea="http://seawide.com">
-  <soapenv:Header/>
-  <soapenv:Body>
-    <sea:GetInventoryFull>
-      <sea:Key>{key}</sea:Key>
-      <sea:FullAccountNo>{account}</sea:FullAccountNo>
-    </sea:GetInventoryFull>
-  </soapenv:Body>
-</soapenv:Envelope>'''
-        req = urllib.request.Request(
-            'https://api.seawide.com/inventory.asmx',
-            data=envelope.encode('utf-8'),
-            headers={'Content-Type': 'text/xml; charset=utf-8',
-                    'SOAPAction': 'http://seawide.com/GetInventoryFull'},
-        )
+        output = self.get_credential('full_output', self.full_output)
+
+        def pull():
+            with SEAWIDE.call('GetInventoryFull', key, account, timeout=self.timeout()) as resp:
+                rows = self.aggregate(metrics.stage('parse', _iter_dataset(resp)))
+                with self.track_delta(rows, output) as rows:
+                    return _write_rows(rows, output, **self.output_options())
+
         try:
-            with urllib.request.urlopen(req) as resp:
-                xml_data = resp.read()
-            rows = _parse_dataset(xml_data)
-            if rows:
-                with open(output, 'w', newline='') as f:
-                    writer = csv.DictWriter(f, fieldnames=rows[0].keys())
-                    writer.writeheader()
-                    writer.writerows(rows)
-                logging.info('Saved Seawide full inventory to %s', output)
+            count = self.call_endpoint(SEAWIDE.url, pull)
+            if count:
+                logging.info('Saved %d Seawide full inventory rows to %s', count, output)
             else:
                 logging.warning('No data returned from Seawide full inventory')
         except Exception as exc:
@@ -158,87 +149,62 @@ class SeawideSupplier(Supplier):
         account = self.get_credential('account_number')
         key = self.get_credential('api_key')
         if account and key:
-            envelope = f'''<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:sea="http://seawide.com">
-  <soapenv:Header/>
-  <soapenv:Body>
-    <sea:GetInventoryUpdates>
-      <sea:Key>{key}</sea:Key>
-      <sea:FullAccountNo>{account}</sea:FullAccountNo>
-    </sea:GetInventoryUpdates>
-  </soapenv:Body>
-</soapenv:Envelope>'''
-            req = urllib.request.Request(
-                'https://api.seawide.com/inventory.asmx',
-                data=envelope.encode('utf-8'),
-                headers={'Content-Type': 'text/xml; charset=utf-8',
-                        'SOAPAction': 'http://seawide.com/GetInventoryUpdates'},
-            )
             try:
-                with urllib.request.urlopen(req, timeout=10) as resp:
-                    if resp.status == 200:
-                        print('Connection successful')
-                        logging.info('Seawide SOAP connection successful')
-                        return
-                    print('Connection failed: status', resp.status)
-                    logging.warning('Seawide SOAP connection failed %s', resp.status)
-                    return
+                with SEAWIDE.call('GetInventoryUpdates', key, account, timeout=10):
+                    pass
+                print('Connection successful')
+                logging.info('Seawide SOAP connection successful')
+                return
+            except soap.SoapError as exc:
+                print('Connection failed: status', exc.status)
+                logging.warning('Seawide SOAP connection failed %s', exc.status)
+                return
             except Exception as exc:
                 logging.exception('Seawide SOAP connection failed: %s', exc)
                 print('Connection failed:', exc)
                 return
 
-        host = self.get_credential('host')
-        user = self.get_credential('username')
-        password = self.get_credential('password')
-        port = int(self.get_credential('port', 21))
-        protocol = self.get_credential('protocol', 'ftps').lower()
-        if not host or not user or not password:
+        credentials = self._ftp_credentials()
+        if not credentials:
             logging.warning('Seawide FTP credentials missing')
             print('Missing credentials')
             return
         try:
-            with (ftplib.FTP() if protocol == 'ftp' else ftplib.FTP_TLS()) as ftp:
-                ftp.connect(host, port, timeout=10)
-                ftp.login(user, password)
-                if protocol != 'ftp':
-                    ftp.prot_p()
-                ftp.quit()
+            from .ftpsession import POOL
+            with POOL.session(**credentials) as ftp:
+                ftp.voidcmd('NOOP')
             logging.info('Seawide FTP connection successful')
             print('Connection successful')
         except Exception as exc:
             logging.exception('Seawide FTP connection failed: %s', exc)
             print('Connection failed:', exc)
 
+    @metrics.instrument('catalog')
     def fetch_catalog(self) -> None:
         """Download the vendor catalog from FTP."""
-        host = self.get_credential('host')
-        user = self.get_credential('username')
-        password = self.get_credential('password')
-        port = int(self.get_credential('port', 21))
+        credentials = self._ftp_credentials()
         remote = self.get_credential('catalog_remote', 'catalog.csv')
         out_dir = self.get_credential('catalog_dir', '.')
         name = self.get_credential('catalog_name', 'seawide_catalog.csv')
         mapping_file = self.get_credential('mapping_file')
         output = os.path.join(out_dir, name)
 
-        if not host or not user or not password:
+        if not credentials:
             logging.warning('Seawide FTP credentials missing')
             return
 
         os.makedirs(out_dir, exist_ok=True)
         try:
-            with (ftplib.FTP() if protocol == 'ftp' else ftplib.FTP_TLS()) as ftp:
-                ftp.connect(host, port)
-                ftp.login(user, password)
-                if protocol != 'ftp':
-                    ftp.prot_p()
-                with open(output, 'wb') as f:
-                    ftp.retrbinary(f'RETR {remote}', f.write)
-            logging.info('Downloaded Seawide catalog to %s', output)
-            with open(output, newline='') as f:
-                rows = list(csv.DictReader(f))
-            rows = catalog.apply_mapping(rows, mapping_file)
-            catalog.save_rows(self.name, rows)
+            with self.conditional_ftp('catalog', remote, output, credentials,
+                                      mapping_file=mapping_file,
+                                      requires=[catalog.db_path(self.name)]) as changed:
+                if not changed:
+                    logging.info('Seawide catalog unchanged, skipping')
+                    print('Catalog unchanged')
+                    return
+                logging.info('Downloaded Seawide catalog to %s', output)
+                rows = parallel.iter_csv(output, self.parse_workers(), mapping_file=mapping_file)
+                catalog.save_rows(self.name, metrics.stage('parse', rows), **self.output_options())
             print('Catalog saved to', catalog.catalog_path(self.name))
         except Exception as exc:
             logging.exception('Failed to fetch Seawide catalog: %s', exc)
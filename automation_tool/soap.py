@@ -0,0 +1,207 @@
+"""Shared SOAP transport with pooled keep-alive connections."""
+
+import http.client
+import logging
+import ssl
+import threading
+import zlib
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from xml.sax.saxutils import escape
+from . import metrics
+
+ENVELOPE = '''<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:{prefix}="{namespace}">
+  <soapenv:Header/>
+  <soapenv:Body>
+    <{prefix}:{operation}>
+      <{prefix}:Key>{key}</{prefix}:Key>
+      <{prefix}:FullAccountNo>{account}</{prefix}:FullAccountNo>
+    </{prefix}:{operation}>
+  </soapenv:Body>
+</soapenv:Envelope>'''
+
+# Idle connections kept per host.
+MAX_IDLE = 4
+READ_SIZE = 64 * 1024
+
+
+class SoapError(Exception):
+    """Raised when a SOAP endpoint answers with a non-200 status."""
+    def __init__(self, status: int, reason: str):
+        super().__init__(f'HTTP {status} {reason}')
+        self.status = status
+        self.reason = reason
+
+
+class Envelope:
+    """Request envelope for one operation with its static XML pre-encoded."""
+    def __init__(self, prefix: str, namespace: str, operation: str):
+        head, middle, tail = ENVELOPE.format(
+            prefix=prefix, namespace=namespace, operation=operation,
+            key='\0', account='\0',
+        ).split('\0')
+        self._head = head.encode('utf-8')
+        self._middle = middle.encode('utf-8')
+        self._tail = tail.encode('utf-8')
+
+    def render(self, key: str, account: str) -> bytes:
+        return b''.join((
+            self._head,
+            escape(str(key)).encode('utf-8'),
+            self._middle,
+            escape(str(account)).encode('utf-8'),
+            self._tail,
+        ))
+
+
+class _Decoded:
+    """File-like reader that inflates a gzip or deflate response body."""
+    def __init__(self, resp, encoding: str):
+        self._resp = resp
+        # gzip needs the gzip header; deflate is zlib-wrapped per RFC 9110.
+        wbits = 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS
+        self._z = zlib.decompressobj(wbits)
+        self._buf = bytearray()
+        self._eof = False
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._eof and (size < 0 or len(self._buf) < size):
+            chunk = self._resp.read(READ_SIZE)
+            if chunk:
+                self._buf += self._z.decompress(chunk)
+            else:
+                self._buf += self._z.flush()
+                self._eof = True
+        if size < 0:
+            size = len(self._buf)
+        data = bytes(self._buf[:size])
+        del self._buf[:size]
+        return data
+
+
+class SoapClient:
+    """Issue HTTP requests over persistent connections pooled per host."""
+    def __init__(self, max_idle: int = MAX_IDLE):
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._context = None
+
+    def _new_connection(self, scheme: str, host: str, port: int, timeout):
+        if scheme == 'https':
+            if self._context is None:
+                self._context = ssl.create_default_context()
+            return http.client.HTTPSConnection(host, port, timeout=timeout, context=self._context)
+        return http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def _acquire(self, key: tuple, timeout):
+        with self._lock:
+            idle = self._idle.get(key)
+            conn = idle.pop() if idle else None
+        if conn is None:
+            return self._new_connection(*key, timeout), False
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def _release(self, key: tuple, conn) -> None:
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        """Close all idle connections."""
+        with self._lock:
+            pools, self._idle = self._idle, {}
+        for idle in pools.values():
+            for conn in idle:
+                conn.close()
+
+    @contextmanager
+    def request(self, method: str, url: str, body: bytes = None, headers: dict = None,
+                timeout=None):
+        """Send a request and yield the response body as a file-like object.
+
+        Bodies sent with ``Content-Encoding: gzip`` or ``deflate`` are
+        inflated while being read. The connection returns to the pool when
+        the body has been read to the end, otherwise it is closed.
+        """
+        parts = urlsplit(url)
+        scheme = parts.scheme or 'http'
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname, port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = dict(headers or {})
+        headers.setdefault('Accept-Encoding', 'gzip, deflate')
+
+        conn, reused = self._acquire(key, timeout)
+        try:
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionError):
+                if not reused:
+                    raise
+                # The server dropped an idle keep-alive connection; retry once.
+                logging.info('Reconnecting to %s:%s', parts.hostname, port)
+                conn.close()
+                conn = self._new_connection(*key, timeout)
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+            if resp.status != 200:
+                resp.read()
+                raise SoapError(resp.status, resp.reason)
+            encoding = (resp.getheader('Content-Encoding') or '').lower()
+            # Count bytes as received on the wire, before inflating.
+            body = metrics.reader('network', resp)
+            yield _Decoded(body, encoding) if encoding in ('gzip', 'deflate') else body
+        except BaseException:
+            conn.close()
+            raise
+        if resp.isclosed() and not resp.will_close:
+            self._release(key, conn)
+        else:
+            conn.close()
+
+
+class Service:
+    """SOAP endpoint whose operations take the account key and number."""
+    def __init__(self, url: str, namespace: str, prefix: str, client: SoapClient = None):
+        self.url = url
+        self.namespace = namespace
+        self.prefix = prefix
+        self.client = client or CLIENT
+        self._envelopes = {}
+
+    def envelope(self, operation: str) -> Envelope:
+        envelope = self._envelopes.get(operation)
+        if envelope is None:
+            envelope = self._envelopes[operation] = Envelope(self.prefix, self.namespace, operation)
+        return envelope
+
+    def call(self, operation: str, key: str, account: str, timeout=None):
+        """Post ``operation`` and return a context manager yielding the response."""
+        return self.client.request(
+            'POST',
+            self.url,
+            body=self.envelope(operation).render(key, account),
+            headers={
+                'Content-Type': 'text/xml; charset=utf-8',
+                'SOAPAction': f'{self.namespace}/{operation}',
+            },
+            timeout=timeout,
+        )
+
+    def ping(self, timeout=None) -> None:
+        """GET the endpoint, raising if it does not answer with 200."""
+        with self.client.request('GET', self.url, timeout=timeout) as resp:
+            resp.read()
+
+
+CLIENT = SoapClient()
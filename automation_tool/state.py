@@ -0,0 +1,58 @@
+"""Small JSON documents persisted under the data directory."""
+
+import json
+import os
+import threading
+from .base import DATA_DIR
+
+STATE_DIR = os.path.join(DATA_DIR, 'state')
+
+_stores = {}
+_lock = threading.Lock()
+
+
+class StateStore:
+    """Key/value state for one component, rewritten atomically on change."""
+    def __init__(self, name: str):
+        self.path = os.path.join(STATE_DIR, f'{name}.json')
+        self._lock = threading.Lock()
+        self._data = None
+
+    def _load(self) -> dict:
+        if self._data is None:
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as f:
+                    self._data = json.load(f)
+            else:
+                self._data = {}
+        return self._data
+
+    def _save(self) -> None:
+        os.makedirs(STATE_DIR, exist_ok=True)
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._data, f)
+        os.replace(tmp, self.path)
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            return self._load().get(key, default)
+
+    def set(self, key: str, value) -> None:
+        with self._lock:
+            self._load()[key] = value
+            self._save()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if self._load().pop(key, None) is not None:
+                self._save()
+
+
+def open_store(name: str) -> StateStore:
+    """Return the shared store called ``name``."""
+    with _lock:
+        store = _stores.get(name)
+        if store is None:
+            store = _stores[name] = StateStore(name)
+        return store
@@ -0,0 +1,174 @@
+"""Merge every supplier's full inventory into one feed keyed by our SKU.
+
+Each source file is normalised to ``(sku, quantity, price, handling time)``
+through the supplier's column names and mapping file, split into sorted runs
+on disk and combined with a streaming k-way merge. At most one run of
+``RUN_SIZE`` offers is held in memory, so the combined catalog can be far
+larger than RAM. For every SKU the best offer according to the policy is
+written:
+
+* ``quantity`` - most stock, then lowest price, then priority
+* ``price`` - lowest price among sources with stock, then most stock
+* ``priority`` - first source in priority order that has stock
+"""
+
+import csv
+import heapq
+import logging
+import os
+import tempfile
+from decimal import Decimal
+from itertools import groupby, islice
+from operator import itemgetter
+from . import outputs, registry
+from .rows import to_decimal, to_int
+
+UNIFIED_FIELDS = ['SKU', 'Quantity', 'Price', 'handling-time', 'Supplier', 'SupplierSKU']
+POLICIES = ('quantity', 'price', 'priority')
+# Rows sorted in memory per run.
+RUN_SIZE = 200000
+
+# Normalised offer: (sku, quantity, price, handling, priority, supplier, supplier_sku)
+_SKU = itemgetter(0)
+_NO_PRICE = Decimal('Infinity')
+
+
+class Source:
+    """One supplier inventory file and how to read it."""
+    def __init__(self, name: str, path: str, sku_field: str = 'SKU',
+                 quantity_field: str = 'Quantity', price_field: str = 'Price',
+                 handling_field: str = 'handling-time', delimiter: str = ',',
+                 mapping_file: str = None, priority: int = 0):
+        self.name = name
+        self.path = path
+        self.sku_field = sku_field
+        self.quantity_field = quantity_field
+        self.price_field = price_field
+        self.handling_field = handling_field
+        self.delimiter = delimiter
+        self.mapping_file = mapping_file
+        self.priority = priority
+
+    @classmethod
+    def from_supplier(cls, supplier, priority: int = 0) -> 'Source':
+        mapping_file = None if supplier.maps_output else supplier.get_credential('mapping_file')
+        return cls(
+            supplier.name,
+            supplier.get_credential('full_output', supplier.full_output),
+            sku_field=supplier.get_credential('sku_field', supplier.sku_field),
+            quantity_field=supplier.get_credential('quantity_field', supplier.quantity_field),
+            price_field=supplier.get_credential('price_field', supplier.price_field),
+            delimiter=supplier.output_delimiter,
+            mapping_file=mapping_file,
+            priority=priority,
+        )
+
+    def offers(self):
+        """Yield normalised offers; SKUs missing from the mapping keep their own."""
+        from inventory_processor import load_mapping
+        mapping = load_mapping(self.mapping_file) if self.mapping_file else {}
+        with open(self.path, newline='') as f:
+            for row in csv.DictReader(f, delimiter=self.delimiter):
+                supplier_sku = row.get(self.sku_field)
+                if not supplier_sku:
+                    continue
+                quantity = to_int(row.get(self.quantity_field) or '0')
+                price = to_decimal(row.get(self.price_field) or '')
+                handling = to_int(row.get(self.handling_field) or '')
+                yield (
+                    mapping.get(supplier_sku, supplier_sku),
+                    quantity if quantity.__class__ is int else 0,
+                    price if isinstance(price, Decimal) else None,
+                    handling if handling.__class__ is int else None,
+                    self.priority,
+                    self.name,
+                    supplier_sku,
+                )
+
+
+def _write_run(directory: str, offers: list) -> str:
+    offers.sort(key=_SKU)
+    fd, path = tempfile.mkstemp(suffix='.run', dir=directory)
+    with os.fdopen(fd, 'w', newline='') as f:
+        writer = csv.writer(f)
+        for sku, quantity, price, handling, priority, supplier, supplier_sku in offers:
+            writer.writerow([
+                sku, quantity, '' if price is None else price,
+                '' if handling is None else handling, priority, supplier, supplier_sku,
+            ])
+    return path
+
+
+def _read_run(path: str):
+    with open(path, newline='') as f:
+        for sku, quantity, price, handling, priority, supplier, supplier_sku in csv.reader(f):
+            yield (
+                sku, int(quantity), Decimal(price) if price else None,
+                int(handling) if handling else None, int(priority), supplier, supplier_sku,
+            )
+
+
+def sorted_runs(offers, directory: str, run_size: int = RUN_SIZE) -> list:
+    """Split ``offers`` into files of at most ``run_size`` offers sorted by SKU."""
+    runs = []
+    offers = iter(offers)
+    while True:
+        chunk = list(islice(offers, run_size))
+        if not chunk:
+            return runs
+        runs.append(_write_run(directory, chunk))
+
+
+def best_offer(offers: list, policy: str = 'quantity') -> tuple:
+    """The offer to publish for one SKU according to ``policy``."""
+    if policy == 'quantity':
+        key = lambda o: (-o[1], o[2] if o[2] is not None else _NO_PRICE, o[4])
+    elif policy == 'price':
+        key = lambda o: (o[1] <= 0, o[2] if o[2] is not None else _NO_PRICE, -o[1], o[4])
+    elif policy == 'priority':
+        key = lambda o: (o[1] <= 0, o[4])
+    else:
+        raise ValueError(f'Unknown merge policy: {policy}')
+    return min(offers, key=key)
+
+
+def merge(sources, output: str, policy: str = 'quantity', run_size: int = RUN_SIZE) -> int:
+    """Write the best offer per SKU from ``sources`` to ``output``.
+
+    Returns the number of SKUs written. A source whose file is missing is
+    skipped with a warning.
+    """
+    if policy not in POLICIES:
+        raise ValueError(f'Unknown merge policy: {policy}')
+    count = 0
+    with tempfile.TemporaryDirectory(prefix='unified-') as directory:
+        runs = []
+        for source in sources:
+            if not os.path.exists(source.path):
+                logging.warning('Skipping %s: %s not found', source.name, source.path)
+                continue
+            source_runs = sorted_runs(source.offers(), directory, run_size)
+            logging.info('Sorted %s into %d runs', source.name, len(source_runs))
+            runs.extend(source_runs)
+        merged = heapq.merge(*(_read_run(path) for path in runs), key=_SKU)
+        with outputs.atomic_open(output, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(UNIFIED_FIELDS)
+            for sku, offers in groupby(merged, key=_SKU):
+                best = best_offer(list(offers), policy)
+                _, quantity, price, handling, _, supplier, supplier_sku = best
+                writer.writerow([
+                    sku, quantity, '' if price is None else price,
+                    '' if handling is None else handling, supplier, supplier_sku,
+                ])
+                count += 1
+    logging.info('Merged %d SKUs into %s by %s', count, output, policy)
+    return count
+
+
+def supplier_sources(keys=None) -> list:
+    """Sources for registered suppliers; list order sets their priority."""
+    return [
+        Source.from_supplier(registry.get(key), priority)
+        for priority, key in enumerate(keys or registry.names())
+    ]
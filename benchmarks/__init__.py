@@ -0,0 +1,4 @@
+"""Benchmarks for the supplier feed pipelines.
+
+Run ``python -m benchmarks.run`` from the repository root.
+"""
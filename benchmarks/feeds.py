@@ -0,0 +1,114 @@
+"""Synthetic supplier feeds shaped like the real ones."""
+
+import csv
+import os
+import random
+
+WAREHOUSES = ['EastQty', 'MidwestQty', 'CaliforniaQty', 'SoutheastQty',
+              'PacificNWQty', 'TexasQty', 'GreatLakesQty', 'FloridaQty']
+
+XML_HEAD = (
+    '<?xml version="1.0" encoding="utf-8"?>\n'
+    '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+    '<soap:Body><GetInventoryFullResponse xmlns="http://eKeystone.com">'
+    '<GetInventoryFullResult>'
+    '<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" id="NewDataSet"/>'
+    '<diffgr:diffgram xmlns:msdata="urn:schemas-microsoft-com:xml-msdata" '
+    'xmlns:diffgr="urn:schemas-microsoft-com:xml-diffgram-v1">'
+    '<NewDataSet xmlns="">'
+)
+XML_TAIL = (
+    '</NewDataSet></diffgr:diffgram></GetInventoryFullResult>'
+    '</GetInventoryFullResponse></soap:Body></soap:Envelope>'
+)
+
+
+def sku(i: int) -> str:
+    return f'BM{i:08d}'
+
+
+def diffgram_xml(path: str, rows: int, seed: int = 0) -> None:
+    """Keystone/Seawide style SOAP dataset with warehouse quantities."""
+    rnd = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(XML_HEAD)
+        for i in range(rows):
+            qty = [rnd.randrange(20) for _ in WAREHOUSES]
+            f.write(
+                f'<Table diffgr:id="Table{i + 1}" msdata:rowOrder="{i}">'
+                f'<VCPN>{sku(i)}</VCPN><VendorCode>BM</VendorCode>'
+                f'<PartNumber>P-{i}</PartNumber>'
+                f'<Cost>{rnd.randrange(100, 100000) / 100:.2f}</Cost>'
+                f'<TotalQty>{sum(qty)}</TotalQty>'
+                + ''.join(f'<{w}>{q}</{w}>' for w, q in zip(WAREHOUSES, qty))
+                + '</Table>'
+            )
+        f.write(XML_TAIL)
+
+
+def cwr_csv(path: str, rows: int, seed: int = 0) -> None:
+    """Headerless CWR feed in ``inventory_processor.FEED_FIELDS`` order."""
+    rnd = random.Random(seed)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        for i in range(rows):
+            nj, fl = rnd.randrange(50), rnd.randrange(50)
+            price = rnd.randrange(100, 100000) / 100
+            writer.writerow([
+                sku(i), nj + fl, f'{rnd.randrange(10 ** 11, 10 ** 12)}',
+                f'Maker {i % 500}', f'{price:.2f}', f'{price * 1.1:.2f}',
+                f'{price * 1.3:.2f}', nj, fl,
+            ])
+
+
+def catalog_csv(path: str, rows: int, seed: int = 0) -> None:
+    """Seawide style catalog with a header and quoted multi-line descriptions."""
+    rnd = random.Random(seed)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['SKU', 'Quantity', 'Price', 'Description'])
+        for i in range(rows):
+            writer.writerow([
+                sku(i), rnd.randrange(100), f'{rnd.randrange(100, 100000) / 100:.2f}',
+                f'Part {i}\n"fits" model {i % 300}' if i % 5 == 0 else f'Part {i}',
+            ])
+
+
+def mapping_csv(path: str, rows: int, every: int = 2) -> None:
+    """Mapping of every ``every``-th SKU for ``merge_mapping``/``map_rows``."""
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['sku', 'modified_sku'])
+        for i in range(0, rows, every):
+            writer.writerow([sku(i), f'M-{sku(i)}'])
+
+
+def delete_csv(path: str, rows: int, every: int = 10) -> None:
+    """Catalog delete file marking every ``every``-th SKU."""
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['SKU', 'DELETE'])
+        for i in range(0, rows, every):
+            writer.writerow([sku(i), 'X'])
+
+
+def generate(directory: str, rows: int) -> dict:
+    """Write every feed for ``rows`` into ``directory`` unless already there."""
+    os.makedirs(directory, exist_ok=True)
+    paths = {
+        'xml': os.path.join(directory, f'keystone_{rows}.xml'),
+        'cwr': os.path.join(directory, f'cwr_{rows}.csv'),
+        'catalog': os.path.join(directory, f'catalog_{rows}.csv'),
+        'mapping': os.path.join(directory, f'mapping_{rows}.csv'),
+        'delete': os.path.join(directory, f'delete_{rows}.csv'),
+    }
+    writers = {
+        'xml': diffgram_xml, 'cwr': cwr_csv, 'catalog': catalog_csv,
+        'mapping': mapping_csv, 'delete': delete_csv,
+    }
+    for kind, path in paths.items():
+        if not os.path.exists(path):
+            tmp = f'{path}.tmp'
+            writers[kind](tmp, rows)
+            os.replace(tmp, path)
+    return paths
@@ -0,0 +1,258 @@
+"""Time the feed pipelines on synthetic data and record the results.
+
+Usage::
+
+    python -m benchmarks.run                      # 10k, 100k and 1M rows
+    python -m benchmarks.run --sizes 10000 --only catalog
+    python -m benchmarks.run --compare            # last two commits
+
+Each benchmark is timed ``--repeat`` times (the fastest run counts) and
+then run once more under ``tracemalloc`` for its memory high-water mark.
+Results are appended to ``benchmarks/results.jsonl`` tagged with the git
+commit so regressions show up in ``--compare``.
+"""
+
+import argparse
+import csv
+import datetime
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from automation_tool import catalog, ftpsession, parallel, soap
+from automation_tool.keystone import _iter_dataset, _parse_dataset
+from automation_tool.rows import record_type
+import inventory_processor
+from inventory_processor import FEED_FIELDS, download_inventory, map_rows, merge_mapping
+from . import feeds
+from .servers import FeedServer, FtpServer
+
+SIZES = (10_000, 100_000, 1_000_000)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_PATH = os.path.join(ROOT, 'benchmarks', 'results.jsonl')
+FEEDS_DIR = os.path.join(tempfile.gettempdir(), 'automation_tool_benchmarks')
+# Slowdown reported as a regression by --compare.
+THRESHOLD = 0.10
+PARSE_WORKERS = os.cpu_count() or 1
+
+
+def _read_cwr(path: str) -> list:
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f, fieldnames=FEED_FIELDS))
+
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _count(rows) -> int:
+    return sum(1 for _ in rows)
+
+
+def cases(paths: dict, size: int, http: FeedServer, ftp: FtpServer, workdir: str) -> list:
+    """``(name, setup, run)`` for every benchmark; ``run`` returns a row count.
+
+    ``setup`` is untimed and returns the argument passed to ``run``.
+    """
+    name = f'bench_{size}'
+    service = soap.Service(http.url, 'http://eKeystone.com', 'ekey', client=soap.SoapClient())
+    feed_url = http.url + '?bench=1'
+    output = os.path.join(workdir, 'ftp_download.xml')
+
+    def soap_stream(_):
+        with service.call('GetInventoryFull', 'key', 'account') as resp:
+            return _count(_iter_dataset(resp))
+
+    def ftp_download(_):
+        ftpsession.POOL.download('inventory_full.xml', output, **ftp.credentials())
+        return size
+
+    def uncached():
+        inventory_processor._mappings.clear()
+        cache = paths['mapping'] + inventory_processor.MAPPING_CACHE_SUFFIX
+        if os.path.exists(cache):
+            os.remove(cache)
+
+    def saved(_=None):
+        catalog.save_rows(name, _read_cwr(paths['cwr']))
+
+    return [
+        ('keystone.parse_dataset',
+         lambda: _read_bytes(paths['xml']),
+         lambda data: len(_parse_dataset(data))),
+        ('keystone.soap_stream', lambda: None, soap_stream),
+        ('ftpsession.download', lambda: None, ftp_download),
+        ('cwr.download_inventory', lambda: None,
+         lambda _: _count(download_inventory(feed_url, 0, record=record_type(FEED_FIELDS)))),
+        ('mapping.parse_csv', uncached,
+         lambda _: len(inventory_processor.load_mapping(paths['mapping']))),
+        ('mapping.load_cache',
+         lambda: inventory_processor._mappings.clear(),
+         lambda _: len(inventory_processor.load_mapping(paths['mapping']))),
+        ('cwr.merge_mapping',
+         lambda: _read_cwr(paths['cwr']),
+         lambda rows: _count(merge_mapping(rows, paths['mapping']))),
+        ('parallel.iter_csv',
+         lambda: None,
+         lambda _: _count(parallel.iter_csv(paths['catalog'], 1, mapping_file=paths['mapping']))),
+        ('parallel.iter_csv_workers',
+         lambda: None,
+         lambda _: _count(parallel.iter_csv(
+             paths['catalog'], PARSE_WORKERS, mapping_file=paths['mapping']))),
+        ('parallel.iter_dataset_workers',
+         lambda: None,
+         lambda _: _count(parallel.iter_dataset(paths['xml'], PARSE_WORKERS))),
+        ('mapping.map_rows',
+         lambda: _read_cwr(paths['cwr']),
+         lambda rows: _count(map_rows(rows, paths['mapping']))),
+        ('catalog.save_rows',
+         lambda: _read_cwr(paths['cwr']),
+         lambda rows: catalog.save_rows(name, rows)),
+        ('catalog.load_rows', saved, lambda _: len(catalog.load_rows(name))),
+        ('catalog.export_csv', saved,
+         lambda _: catalog.export_csv(name, os.path.join(workdir, 'export.csv')) and size),
+        ('catalog.delete_from_file', saved,
+         lambda _: sum(catalog.delete_from_file(name, paths['delete']).values())),
+    ]
+
+
+def measure(setup, run, repeat: int, memory: bool) -> dict:
+    best = None
+    rows = 0
+    for _ in range(repeat):
+        arg = setup()
+        gc.collect()
+        start = time.perf_counter()
+        rows = run(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        del arg
+    result = {'seconds': round(best, 6), 'result_rows': rows}
+    if memory:
+        arg = setup()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            run(arg)
+            result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def git_commit() -> dict:
+    def git(*args):
+        return subprocess.run(
+            ['git', *args], cwd=ROOT, capture_output=True, text=True,
+        ).stdout.strip()
+    return {
+        'commit': git('rev-parse', '--short', 'HEAD') or 'unknown',
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+    }
+
+
+def run(sizes, repeat: int = 3, memory: bool = True, only: str = None,
+        feeds_dir: str = FEEDS_DIR, results_path: str = RESULTS_PATH) -> list:
+    tag = dict(
+        git_commit(),
+        python=platform.python_version(),
+        timestamp=datetime.datetime.now().isoformat(timespec='seconds'),
+    )
+    records = []
+    with tempfile.TemporaryDirectory() as workdir:
+        catalog.CATALOG_DIR = os.path.join(workdir, 'catalogs')
+        os.makedirs(catalog.CATALOG_DIR)
+        for size in sizes:
+            print(f'Generating {size} row feeds in {feeds_dir}')
+            paths = feeds.generate(feeds_dir, size)
+            ftp_files = {'inventory_full.xml': paths['xml']}
+            with FeedServer(paths['xml'], paths['cwr']) as http, FtpServer(ftp_files) as ftp:
+                for name, setup, bench in cases(paths, size, http, ftp, workdir):
+                    if only and only not in name:
+                        continue
+                    result = measure(setup, bench, repeat, memory)
+                    record = dict(tag, benchmark=name, rows=size, **result)
+                    records.append(record)
+                    peak = record.get('peak_bytes')
+                    print(f'{name:<28} {size:>9} rows {record["seconds"]:9.3f}s'
+                          + (f' {peak / 2 ** 20:9.1f} MB peak' if peak is not None else ''))
+            ftpsession.POOL.close()
+    with open(results_path, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+    return records
+
+
+def load_results(path: str = RESULTS_PATH) -> list:
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(results: list, base: str = None, head: str = None,
+            threshold: float = THRESHOLD) -> int:
+    """Print timings of ``head`` against ``base``; returns the regression count."""
+    commits = list(dict.fromkeys(r['commit'] for r in results))
+    if not commits:
+        print('No results recorded')
+        return 0
+    head = head or commits[-1]
+    if base is None:
+        earlier = commits[:commits.index(head)] if head in commits else []
+        if not earlier:
+            print('Need results from two commits to compare')
+            return 0
+        base = earlier[-1]
+    best = {}
+    for r in results:
+        key = (r['commit'], r['benchmark'], r['rows'])
+        seen = best.get(key)
+        best[key] = r if seen is None or r['seconds'] < seen['seconds'] else seen
+    regressions = 0
+    print(f'{"benchmark":<28} {"rows":>9} {base:>10} {head:>10}  change')
+    for (commit, name, rows), new in sorted(best.items(), key=lambda i: (i[0][1], i[0][2])):
+        old = best.get((base, name, rows))
+        if commit != head or old is None:
+            continue
+        change = new['seconds'] / old['seconds'] - 1 if old['seconds'] else 0.0
+        flag = '  REGRESSION' if change > threshold else ''
+        regressions += change > threshold
+        print(f'{name:<28} {rows:>9} {old["seconds"]:9.3f}s {new["seconds"]:9.3f}s'
+              f' {change:+7.1%}{flag}')
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='benchmarks.run', description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default=','.join(str(s) for s in SIZES),
+                        help='Comma separated row counts (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per benchmark')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='Skip the tracemalloc run')
+    parser.add_argument('--only', help='Run benchmarks whose name contains this text')
+    parser.add_argument('--feeds', default=FEEDS_DIR, help='Directory caching generated feeds')
+    parser.add_argument('--results', default=RESULTS_PATH, help='Results file')
+    parser.add_argument('--compare', nargs='*', metavar='COMMIT',
+                        help='Compare recorded results: [BASE [HEAD]]')
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.compare is not None:
+        return 1 if compare(load_results(args.results), *args.compare[:2]) else 0
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    run(sizes, args.repeat, args.memory, args.only, args.feeds, args.results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
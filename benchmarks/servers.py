@@ -0,0 +1,140 @@
+"""Local stand-ins for the supplier SOAP, HTTP and FTP endpoints."""
+
+import http.server
+import os
+import shutil
+import socket
+import socketserver
+import threading
+
+
+class _FeedHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _send_file(self, path):
+        self.send_response(200)
+        self.send_header('Content-Length', str(os.path.getsize(path)))
+        self.end_headers()
+        with open(path, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile, 256 * 1024)
+
+    def do_POST(self):
+        # SOAP call: the envelope is ignored and the dataset returned.
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._send_file(self.server.soap_file)
+
+    def do_GET(self):
+        self._send_file(self.server.csv_file)
+
+    def log_message(self, *args):
+        pass
+
+
+class FeedServer:
+    """HTTP server answering SOAP POSTs with ``soap_file`` and GETs with ``csv_file``."""
+    def __init__(self, soap_file: str = None, csv_file: str = None):
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _FeedHandler)
+        self._server.daemon_threads = True
+        self._server.soap_file = soap_file
+        self._server.csv_file = csv_file
+        self.url = 'http://127.0.0.1:%d/' % self._server.server_address[1]
+
+    def serve(self, soap_file: str = None, csv_file: str = None) -> None:
+        """Switch the files returned by later requests."""
+        self._server.soap_file = soap_file
+        self._server.csv_file = csv_file
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _FtpHandler(socketserver.StreamRequestHandler):
+    """Minimal passive-mode FTP: enough for ``ftpsession`` downloads."""
+    def reply(self, line: str) -> None:
+        self.wfile.write((line + '\r\n').encode())
+        self.wfile.flush()
+
+    def handle(self):
+        files = self.server.files
+        rest = 0
+        passive = None
+        self.reply('220 benchmark ftp ready')
+        while True:
+            line = self.rfile.readline().decode().strip()
+            if not line:
+                return
+            cmd, _, arg = line.partition(' ')
+            cmd = cmd.upper()
+            if cmd == 'USER':
+                self.reply('331 password required')
+            elif cmd == 'PASS':
+                self.reply('230 logged in')
+            elif cmd in ('TYPE', 'NOOP'):
+                self.reply('200 ok')
+            elif cmd == 'SIZE':
+                if arg in files:
+                    self.reply(f'213 {os.path.getsize(files[arg])}')
+                else:
+                    self.reply('550 not found')
+            elif cmd == 'MDTM':
+                self.reply('213 20200101000000' if arg in files else '550 not found')
+            elif cmd == 'REST':
+                rest = int(arg)
+                self.reply('350 restarting')
+            elif cmd in ('PASV', 'EPSV'):
+                passive = socket.socket()
+                passive.bind(('127.0.0.1', 0))
+                passive.listen(1)
+                port = passive.getsockname()[1]
+                if cmd == 'EPSV':
+                    self.reply(f'229 Entering Extended Passive Mode (|||{port}|)')
+                else:
+                    self.reply(f'227 Entering Passive Mode (127,0,0,1,{port >> 8},{port & 255})')
+            elif cmd == 'RETR':
+                if arg not in files or passive is None:
+                    self.reply('550 not found')
+                    continue
+                self.reply('150 sending')
+                conn, _ = passive.accept()
+                try:
+                    with conn, open(files[arg], 'rb') as f:
+                        conn.sendfile(f, rest)
+                except (BrokenPipeError, ConnectionResetError):
+                    self.reply('426 transfer aborted')
+                else:
+                    self.reply('226 transfer complete')
+                passive.close()
+                passive = None
+                rest = 0
+            elif cmd == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('502 not implemented')
+
+
+class FtpServer:
+    """Plain FTP server publishing ``files`` (remote name -> local path)."""
+    def __init__(self, files: dict = None):
+        self._server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _FtpHandler)
+        self._server.daemon_threads = True
+        self._server.files = dict(files or {})
+        self.files = self._server.files
+        self.port = self._server.server_address[1]
+
+    def credentials(self) -> dict:
+        return {'host': '127.0.0.1', 'port': self.port, 'user': 'bench',
+                'password': 'bench', 'protocol': 'ftp'}
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
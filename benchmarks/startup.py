@@ -0,0 +1,110 @@
+"""Time how long the tool takes to start in a fresh interpreter.
+
+Usage::
+
+    python -m benchmarks.startup              # best of 10 runs per command
+    python -m benchmarks.startup --top 15     # also list the slowest imports
+
+Results are appended to ``benchmarks/results.jsonl`` like the feed
+benchmarks, so ``python -m benchmarks.run --compare`` includes them.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from .run import RESULTS_PATH, ROOT, git_commit
+
+# Benchmark name -> interpreter arguments
+COMMANDS = {
+    'startup.import_package': ['-c', 'import automation_tool'],
+    'startup.import_main': ['-c', 'import automation_tool.main'],
+    'startup.cli_help': ['-m', 'automation_tool', '--help'],
+    'startup.import_supplier': ['-c', 'from automation_tool import registry; registry.get("cwr")'],
+    'startup.interpreter': ['-c', 'pass'],
+}
+
+
+def _run(args: list, cwd: str = None, **kwargs) -> subprocess.CompletedProcess:
+    """Run ``python args`` from a scratch directory with the repo importable.
+
+    Importing ``automation_tool.main`` configures ``automation.log`` in the
+    working directory, which must not end up in the repository.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        p for p in (ROOT, os.environ.get('PYTHONPATH')) if p
+    ))
+    if cwd is None:
+        with tempfile.TemporaryDirectory() as cwd:
+            return _run(args, cwd, **kwargs)
+    return subprocess.run([sys.executable, *args], cwd=cwd, env=env, check=True, **kwargs)
+
+
+def time_command(args: list, repeat: int) -> float:
+    """Fastest wall time of ``repeat`` runs of ``python args``."""
+    best = None
+    with tempfile.TemporaryDirectory() as cwd:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            _run(args, cwd, stdout=subprocess.DEVNULL)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def slowest_imports(module: str = 'automation_tool.main', top: int = 10) -> list:
+    """``(cumulative microseconds, module)`` of the slowest imports of ``module``."""
+    proc = _run(['-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True)
+    timings = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        timings.append((int(cumulative), name.strip()))
+    return sorted(timings, reverse=True)[:top]
+
+
+def run(repeat: int = 10, results_path: str = RESULTS_PATH) -> list:
+    tag = dict(
+        git_commit(),
+        python=platform.python_version(),
+        timestamp=datetime.datetime.now().isoformat(timespec='seconds'),
+    )
+    records = []
+    for name, args in COMMANDS.items():
+        seconds = time_command(args, repeat)
+        records.append(dict(tag, benchmark=name, rows=0, seconds=round(seconds, 6), result_rows=0))
+        print(f'{name:<28} {seconds * 1000:9.1f} ms')
+    with open(results_path, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+    return records
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='benchmarks.startup', description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=10, help='Runs per command')
+    parser.add_argument('--top', type=int, default=0,
+                        help='List this many of the slowest imports of automation_tool.main')
+    parser.add_argument('--results', default=RESULTS_PATH, help='Results file')
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    run(args.repeat, args.results)
+    if args.top:
+        print('\nSlowest imports of automation_tool.main:')
+        for cumulative, name in slowest_imports(top=args.top):
+            print(f'{cumulative / 1000:9.1f} ms  {name}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,54 +2,193 @@
 
 import csv
 import json
+import os
+import pickle
 import ssl
+import threading
+import urllib.error
 import urllib.request
 from datetime import datetime, timedelta
 from pathlib import Path
 
 
-def download_inventory(base_url: str, since: int) -> list:
-    """Download CSV data from CWR."""
+FEED_FIELDS = ["SKU", "Quantity", "UPC/EAN", "Manufacturer", "Price", "MAP", "MRP", "qtynj", "qtyfl"]
+OUTPUT_FIELDS = ['SKU', 'Quantity', 'qtynj', 'qtyfl', 'handling-time']
+
+# Parsed mapping files are kept next to the CSV under this suffix.
+MAPPING_CACHE_SUFFIX = '.cache'
+MAPPING_CACHE_VERSION = 1
+
+_mappings = {}
+_mappings_lock = threading.Lock()
+
+
+class NotModified(Exception):
+    """Raised when the feed is unchanged since the supplied validators."""
+
+
+def download_inventory(base_url: str, since: int, validators: dict = None, timeout: float = 60,
+                       record=None):
+    """Yield CSV rows from CWR as they arrive on the socket.
+
+    Rows are dicts keyed by ``FEED_FIELDS``. The automation tool passes a
+    ``record`` type with a ``from_strings`` constructor to get compact rows
+    instead; this script itself only needs the standard library.
+
+    ``validators`` holds the ``etag``/``last_modified`` of a previous
+    download; when given the request is conditional, :class:`NotModified`
+    is raised if the feed is unchanged and the dict is updated in place
+    with the validators of the new response. ``timeout`` bounds each
+    blocking socket operation, so a stalled feed fails instead of hanging.
+    """
     url = f"{base_url}&ohtime={since}"
     context = ssl.create_default_context()
     context.check_hostname = False
     context.verify_mode = ssl.CERT_NONE
-    with urllib.request.urlopen(url, context=context) as resp:
-        return list(csv.DictReader(
-            (line.decode('utf-8') for line in resp),
-            fieldnames=["SKU", "Quantity", "UPC/EAN", "Manufacturer", "Price", "MAP", "MRP", "qtynj", "qtyfl"]
-        ))
+    headers = {}
+    if validators:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+    try:
+        resp = urllib.request.urlopen(urllib.request.Request(url, headers=headers), context=context,
+                                      timeout=timeout)
+    except urllib.error.HTTPError as exc:
+        if exc.code == 304:
+            raise NotModified(url) from None
+        raise
+    with resp:
+        if validators is not None:
+            validators['etag'] = resp.headers.get('ETag')
+            validators['last_modified'] = resp.headers.get('Last-Modified')
+        lines = (line.decode('utf-8') for line in resp)
+        if record is None:
+            yield from csv.DictReader(lines, fieldnames=FEED_FIELDS)
+            return
+        for values in csv.reader(lines):
+            if values:
+                yield record.from_strings(values)
+
+
+def _read_mapping_cache(cache_path: str, key: tuple):
+    try:
+        with open(cache_path, 'rb') as f:
+            version, cached_key, mapping = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError):
+        return None
+    if version != MAPPING_CACHE_VERSION or cached_key != key:
+        return None
+    return mapping
+
+
+def _write_mapping_cache(cache_path: str, key: tuple, mapping: dict) -> None:
+    tmp = f'{cache_path}.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            pickle.dump((MAPPING_CACHE_VERSION, key, mapping), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_path)
+    except OSError:
+        # A read-only mapping directory only costs the re-parse next time.
+        pass
+
 
+def load_mapping(mapping_path) -> dict:
+    """Return the ``sku`` -> ``modified_sku`` dict of a mapping CSV.
 
-def merge_mapping(rows: list, mapping_path: Path) -> list:
-    with open(mapping_path, newline='') as f:
-        mapping = {r['sku']: r['modified_sku'] for r in csv.DictReader(f)}
-    merged = []
+    The parsed dict is memoised per process and pickled next to the CSV,
+    both keyed by the file's mtime and size, so an unchanged mapping is
+    parsed only once. The returned dict is shared and must not be modified.
+    """
+    path = os.path.abspath(mapping_path)
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _mappings_lock:
+        cached = _mappings.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        cache_path = path + MAPPING_CACHE_SUFFIX
+        mapping = _read_mapping_cache(cache_path, key)
+        if mapping is None:
+            with open(path, newline='') as f:
+                mapping = {r['sku']: r['modified_sku'] for r in csv.DictReader(f)}
+            _write_mapping_cache(cache_path, key, mapping)
+        _mappings[path] = (key, mapping)
+        return mapping
+
+
+def map_rows(rows, mapping_path, sku_field: str = 'SKU'):
+    """Yield ``rows`` with the SKUs listed in the mapping file rewritten.
+
+    Unlike :func:`merge_mapping`, rows of unmapped SKUs pass through
+    unchanged, and so does everything when ``mapping_path`` is unset or
+    missing. Rows may be dicts or read-only records with a ``replace``
+    method; the originals are never modified.
+    """
+    if not mapping_path or not os.path.exists(mapping_path):
+        yield from rows
+        return
+    mapping = load_mapping(mapping_path)
+    for r in rows:
+        sku = r.get(sku_field)
+        if sku in mapping:
+            if isinstance(r, dict):
+                r = dict(r)
+                r[sku_field] = mapping[sku]
+            else:
+                r = r.replace(sku_field, mapping[sku])
+        yield r
+
+
+def merge_mapping(rows, mapping_path: Path):
+    """Yield mapped rows for every SKU present in the mapping file.
+
+    The SKU is rewritten and every other column, including ``Price`` and
+    ``MAP``, is kept so deltas and merges still see the supplier's prices.
+    """
+    mapping = load_mapping(mapping_path)
     for r in rows:
         sku = r['SKU']
         if sku in mapping:
-            merged.append({
-                'SKU': mapping[sku],
-                'Quantity': r['Quantity'],
-                'qtynj': r.get('qtynj', 0),
-                'qtyfl': r.get('qtyfl', 0),
-                'handling-time': 0,
-            })
-    return merged
+            row = dict(r, SKU=mapping[sku])
+            for field in ('qtynj', 'qtyfl', 'handling-time'):
+                row.setdefault(field, 0)
+            yield row
+
+
+def write_inventory(rows, f, fields=OUTPUT_FIELDS) -> int:
+    """Write ``fields`` of rows to the open file ``f`` as TSV and return the count."""
+    writer = csv.DictWriter(f, fieldnames=fields, delimiter='\t', extrasaction='ignore')
+    writer.writeheader()
+    count = 0
+    for r in rows:
+        writer.writerow(r)
+        count += 1
+    return count
+
 
+def save_inventory(rows, output: Path) -> int:
+    """Write rows to ``output`` as TSV and return the number written.
 
-def save_inventory(rows: list, output: Path):
-    with open(output, 'w', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=['SKU', 'Quantity', 'qtynj', 'qtyfl', 'handling-time'], delimiter='\t')
-        writer.writeheader()
-        for r in rows:
-            writer.writerow(r)
+    ``output`` is replaced atomically once every row is written, so a failed
+    download leaves the previous file in place.
+    """
+    tmp = f'{output}.{os.getpid()}.tmp'
+    try:
+        with open(tmp, 'w', newline='') as f:
+            count = write_inventory(rows, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, output)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return count
 
 
 def main(base_url: str, since: int, mapping: Path, output: Path):
     rows = download_inventory(base_url, since)
-    merged = merge_mapping(rows, mapping)
-    save_inventory(merged, output)
+    save_inventory(merge_mapping(rows, mapping), output)
 
 
 if __name__ == '__main__':
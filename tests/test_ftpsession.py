@@ -0,0 +1,92 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from automation_tool import ftpsession, resilience
+from benchmarks.servers import FtpServer
+
+
+class DownloadRetryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.source = os.path.join(self.tmp.name, 'source.txt')
+        with open(self.source, 'wb') as f:
+            f.write(b'SKU,QTY\n' * 1000)
+        self.output = os.path.join(self.tmp.name, 'inventory.txt')
+        self.server = FtpServer({'/inventory.txt': self.source})
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+        self.pool = ftpsession.FtpPool()
+        self.addCleanup(self.pool.close)
+
+    def test_first_connect_fails(self):
+        connect = self.pool._connect
+        calls = []
+
+        def flaky(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise ConnectionRefusedError('first attempt')
+            return connect(*args)
+
+        with mock.patch.object(self.pool, '_connect', flaky), \
+                mock.patch.object(ftpsession.time, 'sleep'):
+            stat = self.pool.download('/inventory.txt', self.output,
+                                      **self.server.credentials())
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(stat['size'], os.path.getsize(self.source))
+        with open(self.output, 'rb') as f, open(self.source, 'rb') as g:
+            self.assertEqual(f.read(), g.read())
+        self.assertFalse(os.path.exists(self.output + '.part'))
+
+    def _leave_part(self, data, stat):
+        with open(self.output + '.part', 'wb') as f:
+            f.write(data)
+        with open(self.output + '.part.stat', 'w') as f:
+            json.dump(stat, f)
+
+    def _stat(self):
+        return {'mdtm': 1577836800, 'size': os.path.getsize(self.source)}
+
+    def _download_after_failed_connect(self):
+        connect = self.pool._connect
+        calls = []
+
+        def flaky(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise ConnectionRefusedError('first attempt')
+            return connect(*args)
+
+        with mock.patch.object(self.pool, '_connect', flaky), \
+                mock.patch.object(ftpsession.time, 'sleep'):
+            self.pool.download('/inventory.txt', self.output, **self.server.credentials())
+        with open(self.output, 'rb') as f, open(self.source, 'rb') as g:
+            return f.read() == g.read()
+
+    def test_retry_discards_part_of_other_remote_file(self):
+        self._leave_part(b'X' * 100, dict(self._stat(), size=5000))
+        self.assertTrue(self._download_after_failed_connect())
+        self.assertFalse(os.path.exists(self.output + '.part.stat'))
+
+    def test_retry_resumes_matching_part(self):
+        with open(self.source, 'rb') as f:
+            head = f.read(100)
+        self._leave_part(head, self._stat())
+        self.assertTrue(self._download_after_failed_connect())
+
+    def test_lost_race_stops_and_removes_its_part(self):
+        token = resilience.Token()
+        ticket = token.ticket('fallback')
+        token.ticket('primary').claim()
+        with self.assertRaises(resilience.Cancelled):
+            self.pool.download('/inventory.txt', self.output, ticket=ticket,
+                               **self.server.credentials())
+        self.assertEqual(os.listdir(self.tmp.name), ['source.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()